@@ -1,10 +1,14 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from collections import OrderedDict
 from orderedset import OrderedSet
 import functools
+import bisect
+import heapq
 from mc_instruction import MCInstruction
 from mc_function import MCFunction
 from cfg import CFG
+from liveness import Liveness, should_map, number_regs
+from bitset import iter_bits
 import re
 from pprint import PrettyPrinter
 
@@ -17,65 +21,24 @@ def convert_map(temp_map):
 
     return reg_map
 
-def should_map(reg: str, args: List[str]):
-    pattern = re.compile(r"\$[stav]\d|zero|$\d+")
-
-    not_physical = pattern.match(reg) is None
-    not_arg = reg not in args
-
-    return not_physical and not_arg
-
-def reg_instr_counts(reg, instrs):
-    count = 0
+def get_phys_regs(use_saved=False) -> List[str]:
+    # t7-t9 are left for the spill code in the second pass
+    phys_regs = ["$t%d" % i for i in range(7)]
+    if use_saved:
+        phys_regs += ["$s%d" % i for i in range(8)]
+    return phys_regs
+
+def reference_counts(instrs: List[MCInstruction], args) -> Dict[str, int]:
+    """
+    Counts the instructions that reference every virtual register, in one pass over the instructions.
+    """
+    counts = {}
     for instr in instrs:
-        if instr.regs is not None and reg in instr.regs:
-            count += 1
-
-    return count
-
-def compare_regs(reg1, reg2, instrs: List[MCInstruction]):
-    count1 = reg_instr_counts(reg1, instrs)
-    count2 = reg_instr_counts(reg2, instrs)
-
-    count_diff = count1 - count2
-    if count_diff != 0:
-        return count_diff
-    else:
-        if reg1 < reg2:
-            return -1
-        else:
-            return 1
-
-def sorted_regs(regs: List[str], instrs: List[MCInstruction]):
-    sorted_regs = sorted(regs, key=lambda reg: reg_instr_counts(reg, instrs), reverse=True)
-    return sorted_regs
-
-def next_def(reg, d, i):
-    if reg not in d:
-        return None
-
-    elements = d[reg]
-    elements = list(elements)
-    elements.sort()
-    for ele in elements:
-        if ele >= i:
-            return ele
-
-    return None
-
-def next_use(reg, d, i, total_length):
-    if reg not in d:
-        return None
-
-    elements = d[reg]
-    elements =list(elements)
-    elements.sort()
-
-    for ele in elements:
-        if ele >= i:
-            return ele
-
-    return None
+        if instr.regs is not None:
+            for reg in set(instr.regs):
+                if should_map(reg, args):
+                    counts[reg] = counts.get(reg, 0) + 1
+    return counts
 
 def does_interfere(range1: Tuple[int, int], range2: Tuple[int, int]):
     if range1 is None or range2 is None:
@@ -86,6 +49,31 @@ def does_interfere(range1: Tuple[int, int], range2: Tuple[int, int]):
 
     return start1 <= end2 and start2 <= end1
 
+def interference_from_ranges(ranges: List[Optional[Tuple[int, int]]]) -> List[List[int]]:
+    """
+    Builds the interference graph of a set of live ranges with a sweep over their sorted endpoints, in O((R + E) log R). Ranges are visited in order of their start, and each one interferes with exactly the ranges still active when it starts (the same overlap does_interfere checks), so only real overlaps are ever touched.
+
+    Args:
+        ranges: the (first, last) live point of every register id, or None if it is never live
+    Returns:
+        the neighbor ids of every register id
+    """
+    adj = [[] for _ in range(len(ranges))]
+    order = sorted((reg for reg in range(len(ranges)) if ranges[reg] is not None), key=lambda reg: ranges[reg][0])
+    ends = [] # heap of (end, reg) of the active ranges
+    active = {}
+    for reg in order:
+        start, end = ranges[reg]
+        while len(ends) != 0 and ends[0][0] < start:
+            _, done = heapq.heappop(ends)
+            del active[done]
+        adj[reg] += active
+        for other in active:
+            adj[other].append(reg)
+        heapq.heappush(ends, (end, reg))
+        active[reg] = None
+    return adj
+
 def get_regs_from_instructions(instrs: List[MCInstruction], args):
     regs = []
     for instr in instrs:
@@ -95,60 +83,85 @@ def get_regs_from_instructions(instrs: List[MCInstruction], args):
 
     return list(OrderedSet(regs))
 
-def get_live_ranges(instrs: List[MCInstruction], args):
+def coalescable_moves(instrs: List[MCInstruction], args) -> List[Tuple[str, str]]:
+    """
+    Finds the (destination, source) of every move between two virtual registers.
+    """
+    moves = []
+    for instr in instrs:
+        if instr.op == "move" and should_map(instr.regs[0], args) and should_map(instr.regs[1], args) \
+                and instr.regs[0] != instr.regs[1]:
+            moves.append((instr.regs[0], instr.regs[1]))
+    return moves
+
+def can_coalesce(keep_adj, gone_adj, degree, k: int) -> bool:
+    """
+    Decides whether two non-interfering nodes can be merged without making the graph harder to color. The Briggs test allows it when the merged node has fewer than k neighbors of significant degree (k or more), and the George test when every neighbor of one node either already interferes with the other or has insignificant degree.
+
+    Args:
+        - keep_adj: the neighbors of the node that is kept
+        - gone_adj: the neighbors of the node merged into it
+        - degree: the current degree of a node
+        - k: the number of physical registers
+    """
+    significant = 0
+    for other in keep_adj | gone_adj:
+        # a neighbor of both nodes loses an edge when they are merged
+        other_degree = degree(other) - (1 if other in keep_adj and other in gone_adj else 0)
+        if other_degree >= k:
+            significant += 1
+    if significant < k:
+        return True
+    return all(other in keep_adj or degree(other) < k for other in gone_adj) or \
+        all(other in gone_adj or degree(other) < k for other in keep_adj)
+
+def remove_coalesced_moves(function: MCFunction) -> int:
+    """
+    Deletes the moves whose source and destination were given the same physical register, once the function is allocated.
+
+    Returns:
+        - the number of moves deleted
+    """
+    removed = 0
+    for bbid, bb in function.bbs.items():
+        reg_map = function.reg_maps[bbid]
+        kept = []
+        for instr in bb:
+            if instr.op == "move":
+                dest = reg_map.get(instr.regs[0])
+                if dest is not None and dest != "spill" and dest == reg_map.get(instr.regs[1]):
+                    removed += 1
+                    continue
+            kept.append(instr)
+        if len(kept) != len(bb):
+            bb[:] = kept
+    return removed
+
+def get_live_ranges(instrs: List[MCInstruction], args, live_out=None):
+    """
+    Computes the live range of every virtual register in a single block with one backward pass.
+
+    Args:
+        instrs: the instructions of the block
+        args: the function arguments (never mapped)
+        live_out: the registers live after the block. Without global liveness every register in the block is assumed to be used by a later block.
+
+    Returns:
+        a map from register to its (first, last) live program point
+    """
     # NOTE: here the index is right before the instruction (program point)
-    regs = get_regs_from_instructions(instrs, args)
-
-    # uses = {}
-    # defs = {}
-    uses = OrderedDict()
-    defs = OrderedDict()
-
-    for i, instr in enumerate(instrs):
-        if instr.regs is not None:
-            for reg in instr.get_uses():
-                if should_map(reg, args):
-                    if reg not in uses:
-                        uses[reg] = OrderedSet()
-                    uses[reg].add(i)
-            for reg in instr.get_defs():
-                if should_map(reg, args):
-                    if reg not in defs:
-                        defs[reg] = OrderedSet()
-                    defs[reg].add(i)
-
-    use_keys = OrderedSet(uses.keys())
-    def_keys = OrderedSet(defs.keys())
-    # print("use defs: ", use_keys.union(def_keys))
-    # print("regs:", OrderedSet(regs))
-    # assert(use_keys.union(def_keys) == OrderedSet(regs))
-    # print(use_keys.union(def_keys))
-    # assert()
-
-    live_points = {reg: OrderedSet() for reg in regs}
-
-    for reg in regs:
-        for i in range(len(instrs)+1):
-            n_use = next_use(reg, uses, i, len(instrs))
-            n_def = next_def(reg, defs, i)
-
-            if n_def is None:
-                live_points[reg].add(i)
-            elif n_use is not None:
-                if i <= n_use and n_use <= n_def:
-                    live_points[reg].add(i)
-
-
-    live_ranges = {}
-    for reg in regs:
-        live_set = live_points[reg]
-        if len(live_set) == 0:
-            live_ranges[reg] = None
-        else:
-            live_ranges[reg] = min(live_set), max(live_set)
+    reg_ids = {}
+    regs = []
+    instr_regs = number_regs(instrs, args, reg_ids, regs)
 
+    if live_out is None:
+        live_out = regs
+    live_out_bits = 0
+    for reg in live_out:
+        if reg in reg_ids:
+            live_out_bits |= 1 << reg_ids[reg]
 
-    return live_ranges
+    return Liveness.ranges_from(instrs, instr_regs, live_out_bits, regs)
 
 class NaiveAllocator:
     def __init__(self, function: MCFunction):
@@ -181,6 +194,7 @@ class LocalAllocator:
         self.cfg = CFG(function.body)
         self.use_saved = use_saved
         self.function = function
+        self.liveness = Liveness(self.cfg, function.args)
         self.reg_maps = self.get_reg_maps()
 
     def get_reg_maps(self):
@@ -192,7 +206,9 @@ class LocalAllocator:
         for bbid in sorted_keys:
         # for bbid, instrs in self.cfg.bbs.items():
             instrs = self.cfg.bbs[bbid]
-            reg_map = LocalAllocator.alloc_for_bb(instrs, use_saved=self.use_saved, args=self.function.args)
+            live_ranges = self.liveness.live_ranges(bbid)
+            # every reference in a block has the same loop depth, so the registers are ranked by their plain reference counts
+            reg_map = LocalAllocator.alloc_for_bb(instrs, use_saved=self.use_saved, args=self.function.args, live_ranges=live_ranges)
             reg_maps[bbid] = reg_map
 
         return reg_maps
@@ -200,43 +216,387 @@ class LocalAllocator:
     def map_function(self):
         self.function.set_bbs(self.cfg.bbs)
         self.function.set_reg_maps(self.reg_maps)
+        self.function.set_liveness(self.liveness)
 
     @staticmethod
-    def alloc_for_bb(instrs: List[MCInstruction], use_saved=False, args=None):
+    def alloc_for_bb(instrs: List[MCInstruction], use_saved=False, args=None, live_ranges=None):
+        """
+        Colors the interference graph of a single block greedily, the registers referenced most often first.
+        """
         regs = get_regs_from_instructions(instrs, args)
-        live_ranges = get_live_ranges(instrs, args)
-        adj_list = {reg: OrderedSet() for reg in regs}
-        for i, reg1 in enumerate(regs):
-            for j, reg2 in enumerate(regs):
-                if i != j:
-                    reg1_range = live_ranges[reg1]
-                    reg2_range = live_ranges[reg2]
-                    if does_interfere(reg1_range, reg2_range):
-                        adj_list[reg1].add(reg2)
-                        adj_list[reg2].add(reg1)
-
-        phys_regs = ["$t%d" % i for i in range(7)]
-        if use_saved:
-            phys_regs += ["$s%d" % i for i in range(8)]
-
-        ordered_regs = sorted_regs(regs, instrs)
+        if live_ranges is None:
+            live_ranges = get_live_ranges(instrs, args)
+        costs = reference_counts(instrs, args)
+        reg_ids = {reg: i for i, reg in enumerate(regs)}
+        adj = interference_from_ranges([live_ranges[reg] for reg in regs])
+
+        phys_regs = get_phys_regs(use_saved)
+        members = LocalAllocator.coalesce(instrs, args, reg_ids, adj, len(phys_regs))
+
+        ordered_regs = sorted(members.keys(), key=lambda reg: sum(costs.get(regs[member], 0) for member in members[reg]), reverse=True)
 
         temp_map = {phys: OrderedSet() for phys in phys_regs}
         temp_map["spill"] = OrderedSet()
+        colors = [None] * len(regs)
 
+        for reg in ordered_regs:
+            used = {colors[other] for other in adj[reg]}
+            phys = next((phys for phys in phys_regs if phys not in used), "spill")
+            colors[reg] = phys
+            temp_map[phys].update(regs[member] for member in members[reg])
 
-        while len(ordered_regs) != 0:
-            reg = ordered_regs.pop(0)
-            mapped = False
+        reg_map = convert_map(temp_map)
+
+        return reg_map
+
+
+    @staticmethod
+    def coalesce(instrs: List[MCInstruction], args, reg_ids: Dict[str, int], adj: List[List[int]], k: int):
+        """
+        Merges the source and destination of the moves in a block whose live ranges do not overlap, if can_coalesce allows it. The neighbor lists are updated in place so a merged node carries the edges of all its members.
+
+        Returns:
+            an ordered map from every remaining node id to the ids merged into it (itself included)
+        """
+        members = OrderedDict((reg, [reg]) for reg in range(len(adj)))
+        alias = {}
+
+        def find(reg):
+            while reg in alias:
+                reg = alias[reg]
+            return reg
+
+        for dest, src in coalescable_moves(instrs, args):
+            keep, gone = find(reg_ids[dest]), find(reg_ids[src])
+            if keep == gone or gone in adj[keep]:
+                continue
+            keep_adj, gone_adj = set(adj[keep]), set(adj[gone])
+            if not can_coalesce(keep_adj, gone_adj, lambda reg: len(adj[reg]), k):
+                continue
+            for other in gone_adj:
+                adj[other].remove(gone)
+                if other not in keep_adj:
+                    adj[other].append(keep)
+                    adj[keep].append(other)
+            adj[gone] = []
+            alias[gone] = keep
+            members[keep] += members.pop(gone)
+
+        return members
+
+
+class GlobalAllocator:
+    """
+    Chaitin-Briggs graph coloring over the whole function. The interference graph is built from the global liveness, so a single register map is used for every block and values stay in their register across block boundaries.
+    """
+    def __init__(self, function: MCFunction, use_saved=False):
+        self.cfg = CFG(function.body)
+        self.use_saved = use_saved
+        self.function = function
+        self.liveness = Liveness(self.cfg, function.args)
+        self.adj = self.build_interference()
+        self.reg_map = self.color()
+
+    def build_interference(self) -> List[int]:
+        """
+        Builds the interference graph as one adjacency bitset per register id. Every definition interferes with everything live right after it.
+        """
+        liveness = self.liveness
+        adj = [0] * len(liveness.regs)
+        for bbid in sorted(self.cfg.bbs.keys()):
+            points = liveness.live_points(bbid)
+            for i, (instr, (uses, defs)) in enumerate(zip(self.cfg.bbs[bbid], liveness.instr_regs[bbid])):
+                live_after = points[i+1]
+                if instr.op == "move" and len(uses) == 1:
+                    # the destination of a move holds the same value as its source, so they only interfere if one is redefined while the other is live
+                    live_after &= ~(1 << uses[0])
+                for reg in defs:
+                    adj[reg] |= live_after & ~(1 << reg)
+
+        # everything live into the function is defined together on entry (arrays are set up by the prologue)
+        sorted_keys = sorted(self.cfg.bbs.keys())
+        if len(sorted_keys) != 0:
+            entry_live = liveness.live_in[sorted_keys[0]]
+            for reg in iter_bits(entry_live):
+                adj[reg] |= entry_live & ~(1 << reg)
+
+        # make the graph symmetric
+        for reg in range(len(adj)):
+            for other in iter_bits(adj[reg]):
+                adj[other] |= 1 << reg
+
+        return adj
+
+    def coalesce(self, k: int) -> List[int]:
+        """
+        Conservatively coalesces the virtual registers connected by a move that do not interfere, merging the node of the source into the node of the destination when can_coalesce allows it.
+
+        Returns:
+            the node every register id was merged into (itself if it was not merged)
+        """
+        adj = self.adj
+        alias = list(range(len(adj)))
+
+        def find(reg):
+            while alias[reg] != reg:
+                reg = alias[reg]
+            return reg
+
+        def degree(reg):
+            return bin(adj[reg]).count("1")
+
+        for bbid in sorted(self.cfg.bbs.keys()):
+            for instr, (uses, defs) in zip(self.cfg.bbs[bbid], self.liveness.instr_regs[bbid]):
+                if instr.op != "move" or len(uses) != 1 or len(defs) != 1:
+                    continue
+                keep, gone = find(defs[0]), find(uses[0])
+                if keep == gone or adj[keep] & (1 << gone):
+                    continue
+                if not can_coalesce(set(iter_bits(adj[keep])), set(iter_bits(adj[gone])), degree, k):
+                    continue
+                for other in iter_bits(adj[gone]):
+                    adj[other] = (adj[other] & ~(1 << gone)) | (1 << keep)
+                adj[keep] |= adj[gone]
+                adj[gone] = 0
+                alias[gone] = keep
+
+        return [find(reg) for reg in range(len(adj))]
+
+    def color(self):
+        phys_regs = get_phys_regs(self.use_saved)
+        k = len(phys_regs)
+        adj = self.adj
+        num = len(adj)
+        costs = self.liveness.spill_costs()
+        alias = self.coalesce(k)
+        for reg in range(num):
+            if alias[reg] != reg:
+                costs[alias[reg]] += costs[reg]
+
+        # simplify: remove nodes of degree < k, optimistically pushing a spill candidate when stuck (merged registers are colored with the node they were merged into)
+        degrees = [bin(adj[reg]).count("1") for reg in range(num)]
+        removed = 0
+        for reg in range(num):
+            if alias[reg] != reg:
+                removed |= 1 << reg
+        stack = []
+        low = [reg for reg in range(num - 1, -1, -1) if degrees[reg] < k and alias[reg] == reg]
+        remaining = num - bin(removed).count("1")
+        while remaining != 0:
+            reg = None
+            while len(low) != 0:
+                candidate = low.pop()
+                if not removed & (1 << candidate):
+                    reg = candidate
+                    break
+            if reg is None:
+                best = None
+                for candidate in range(num):
+                    if removed & (1 << candidate):
+                        continue
+                    weight = costs[candidate] / max(degrees[candidate], 1)
+                    if best is None or weight < best:
+                        best = weight
+                        reg = candidate
+
+            removed |= 1 << reg
+            remaining -= 1
+            stack.append(reg)
+            for other in iter_bits(adj[reg] & ~removed):
+                degrees[other] -= 1
+                if degrees[other] == k - 1:
+                    low.append(other)
+
+        # select: pop and take the first register no colored neighbor uses
+        colors = {}
+        while len(stack) != 0:
+            reg = stack.pop()
+            used = set()
+            for other in iter_bits(adj[reg]):
+                if other in colors:
+                    used.add(colors[other])
+            colors[reg] = "spill"
             for phys in phys_regs:
-                curr = temp_map[phys]
-                if adj_list[reg].isdisjoint(curr):
-                    temp_map[phys].add(reg)
-                    mapped = True
+                if phys not in used:
+                    colors[reg] = phys
                     break
-            if not mapped:
-                temp_map["spill"].add(reg)
-
-        reg_map = convert_map(temp_map)
 
+        reg_map = OrderedDict()
+        for reg, name in enumerate(self.liveness.regs):
+            reg_map[name] = colors[alias[reg]]
         return reg_map
+
+    def map_function(self):
+        self.function.set_bbs(self.cfg.bbs)
+        self.function.set_reg_maps({bbid: self.reg_map for bbid in self.cfg.bbs.keys()}, resident=self.reg_map)
+        self.function.set_liveness(self.liveness)
+
+class LinearScanAllocator:
+    """
+    Linear scan over live intervals numbered on the linearized function body, for functions where graph coloring is too slow.
+
+    Every block gets its own span of program points, and each virtual register gets one interval from its first to its last live point. Intervals are scanned in order of their start. When no register is free, the interval with the lowest spill weight (references, weighted by loop depth, per point covered) among the current and active intervals is split at block boundaries: its per-block pieces are then allocated block by block around the registers held by the unsplit intervals, and are loaded and saved at block boundaries like the local allocator does.
+    """
+    def __init__(self, function: MCFunction, use_saved=False):
+        self.cfg = CFG(function.body)
+        self.use_saved = use_saved
+        self.function = function
+        self.liveness = Liveness(self.cfg, function.args)
+        self.phys_regs = get_phys_regs(use_saved)
+        self.build_intervals()
+        self.resident, self.split = self.scan()
+        self.reg_maps = self.alloc_pieces()
+
+    def build_intervals(self):
+        liveness = self.liveness
+        num = len(liveness.regs)
+        ids = list(range(num))
+
+        self.bases = []
+        self.pieces = {}
+        self.starts = [None] * num
+        self.ends = [None] * num
+        # references weighted by loop depth
+        self.refs = liveness.spill_costs()
+
+        base = 0
+        for bbid in sorted(self.cfg.bbs.keys()):
+            instrs = self.cfg.bbs[bbid]
+            instr_regs = liveness.instr_regs[bbid]
+            pieces = Liveness.ranges_from(instrs, instr_regs, liveness.live_out[bbid], ids)
+            self.pieces[bbid] = pieces
+            self.bases.append(base)
+
+            # registers live through the block without being referenced
+            through = liveness.live_in[bbid] & liveness.live_out[bbid]
+            spans = list(pieces.items())
+            spans += [(reg, (0, len(instrs))) for reg in iter_bits(through) if reg not in pieces]
+
+            for reg, span in spans:
+                if span is None:
+                    continue
+                start, end = base + span[0], base + span[1]
+                if self.starts[reg] is None or start < self.starts[reg]:
+                    self.starts[reg] = start
+                if self.ends[reg] is None or end > self.ends[reg]:
+                    self.ends[reg] = end
+
+            base += len(instrs) + 1
+
+        # everything live into the function is defined together on entry
+        for reg in iter_bits(liveness.live_in.get(0, 0)):
+            self.starts[reg] = 0
+
+    def weight(self, reg) -> float:
+        return self.refs[reg] / (self.ends[reg] - self.starts[reg] + 1)
+
+    def scan(self):
+        phys_regs = self.phys_regs
+        order = [reg for reg in range(len(self.starts)) if self.starts[reg] is not None]
+        order.sort(key=lambda reg: (self.starts[reg], reg))
+
+        resident = {}
+        split = set()
+        active = [] # (end, reg), sorted by end
+        free = list(phys_regs)
+
+        for reg in order:
+            start = self.starts[reg]
+            while len(active) != 0 and active[0][0] < start:
+                _, done = active.pop(0)
+                free.append(resident[done])
+
+            if len(free) != 0:
+                free.sort(key=phys_regs.index)
+                resident[reg] = free.pop(0)
+                bisect.insort(active, (self.ends[reg], reg))
+                continue
+
+            victim = min([other for _, other in active] + [reg], key=lambda other: (self.weight(other), other))
+            split.add(victim)
+            if victim != reg:
+                active.remove((self.ends[victim], victim))
+                resident[reg] = resident.pop(victim)
+                bisect.insort(active, (self.ends[reg], reg))
+
+        return resident, split
+
+    def occupied_blocks(self) -> List[set]:
+        """
+        Computes, for every block, the physical registers held by an unsplit interval somewhere in that block.
+        """
+        num_blocks = len(self.bases)
+        diffs = {phys: [0] * (num_blocks + 1) for phys in self.phys_regs}
+        for reg, phys in self.resident.items():
+            first = bisect.bisect_right(self.bases, self.starts[reg]) - 1
+            last = bisect.bisect_right(self.bases, self.ends[reg]) - 1
+            diffs[phys][first] += 1
+            diffs[phys][last + 1] -= 1
+
+        occupied = [set() for _ in range(num_blocks)]
+        for phys, diff in diffs.items():
+            count = 0
+            for block in range(num_blocks):
+                count += diff[block]
+                if count != 0:
+                    occupied[block].add(phys)
+        return occupied
+
+    def alloc_pieces(self):
+        regs = self.liveness.regs
+        occupied = self.occupied_blocks()
+        reg_maps = {}
+
+        for block, bbid in enumerate(sorted(self.cfg.bbs.keys())):
+            pieces = self.pieces[bbid]
+            available = [phys for phys in self.phys_regs if phys not in occupied[block]]
+
+            order = [reg for reg in pieces if reg in self.split and pieces[reg] is not None]
+            order.sort(key=lambda reg: (pieces[reg][0], reg))
+
+            piece_refs = {}
+            for uses, defs in self.liveness.instr_regs[bbid]:
+                for reg in uses + defs:
+                    piece_refs[reg] = piece_refs.get(reg, 0) + 1
+
+            def piece_weight(reg):
+                start, end = pieces[reg]
+                return piece_refs.get(reg, 0) / (end - start + 1)
+
+            assigned = {}
+            active = []
+            free = list(available)
+            for reg in order:
+                start, end = pieces[reg]
+                while len(active) != 0 and active[0][0] < start:
+                    _, done = active.pop(0)
+                    free.append(assigned[done])
+
+                if len(free) != 0:
+                    free.sort(key=self.phys_regs.index)
+                    assigned[reg] = free.pop(0)
+                    bisect.insort(active, (end, reg))
+                    continue
+
+                victim = min([other for _, other in active] + [reg], key=lambda other: (piece_weight(other), other))
+                if victim != reg:
+                    active.remove((pieces[victim][1], victim))
+                    assigned[reg] = assigned.pop(victim)
+                    bisect.insort(active, (end, reg))
+
+            reg_map = OrderedDict()
+            for reg in pieces:
+                if reg in self.resident:
+                    reg_map[regs[reg]] = self.resident[reg]
+                else:
+                    reg_map[regs[reg]] = assigned.get(reg, "spill")
+            reg_maps[bbid] = reg_map
+
+        return reg_maps
+
+    def map_function(self):
+        regs = self.liveness.regs
+        resident = OrderedDict((regs[reg], phys) for reg, phys in sorted(self.resident.items()))
+        self.function.set_bbs(self.cfg.bbs)
+        self.function.set_reg_maps(self.reg_maps, resident=resident)
+        self.function.set_liveness(self.liveness)
@@ -0,0 +1,98 @@
+from allocator import LocalAllocator, does_interfere, get_live_ranges, interference_from_ranges, get_regs_from_instructions
+from mc_instruction import MCInstruction
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import argparse
+import json
+import time
+
+arg_parser = argparse.ArgumentParser(description='time interference construction and local allocation on single blocks of growing size')
+arg_parser.add_argument('--sizes', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000, 8000, 16000], help='number of virtual registers in each block')
+arg_parser.add_argument('--window', type=int, default=8, help='how many instructions after its definition every register is used, which sets how many registers are live at once')
+arg_parser.add_argument('--repeat', type=int, default=3, help='runs per size, the fastest of which is reported')
+arg_parser.add_argument('--pairwise-limit', type=int, default=4000, help='largest size to also time the all-pairs construction on')
+arg_parser.add_argument('--saved', action='store_true', default=False)
+arg_parser.add_argument('--output', type=str, default=None, help='JSON file the results are written to')
+
+
+def straight_line_block(num_regs: int, window: int) -> List[MCInstruction]:
+    """
+    Builds a block shaped like unrolled array code: every register is loaded from an array and added into an accumulator `window` instructions later, so about 2 * window registers are live at every point.
+    """
+    instrs = [MCInstruction("li", regs=["acc"], imm=0)]
+    for i in range(num_regs + window):
+        if i < num_regs:
+            instrs.append(MCInstruction("lw", regs=["v%d" % i, "$fp"], offset=4 * i))
+        if i >= window:
+            instrs.append(MCInstruction("addu", regs=["acc", "acc", "v%d" % (i - window)]))
+    instrs.append(MCInstruction("sw", regs=["acc", "$fp"], offset=0))
+    return instrs
+
+
+def pairwise_interference(ranges: List[Optional[Tuple[int, int]]]) -> List[List[int]]:
+    # the all-pairs construction the sweep replaced, kept as the baseline
+    adj = [[] for _ in range(len(ranges))]
+    for i in range(len(ranges)):
+        for j in range(i + 1, len(ranges)):
+            if does_interfere(ranges[i], ranges[j]):
+                adj[i].append(j)
+                adj[j].append(i)
+    return adj
+
+
+def best_time(repeat: int, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def measure(num_regs: int, args) -> dict:
+    instrs = straight_line_block(num_regs, args.window)
+    regs = get_regs_from_instructions(instrs, [])
+    # nothing is live out of the block, so the ranges are as short as the code allows
+    live_ranges = get_live_ranges(instrs, [], live_out=[])
+    ranges = [live_ranges[reg] for reg in regs]
+
+    sweep, adj = best_time(args.repeat, lambda: interference_from_ranges(ranges))
+    edges = sum(len(neighbors) for neighbors in adj) // 2
+    result = OrderedDict([("registers", len(regs)), ("instructions", len(instrs)), ("edges", edges), ("sweep", sweep)])
+
+    if num_regs <= args.pairwise_limit:
+        pairwise, pairwise_adj = best_time(args.repeat, lambda: pairwise_interference(ranges))
+        assert([sorted(neighbors) for neighbors in pairwise_adj] == [sorted(neighbors) for neighbors in adj])
+        result["pairwise"] = pairwise
+    else:
+        result["pairwise"] = None
+
+    result["alloc_for_bb"], _ = best_time(args.repeat, lambda: LocalAllocator.alloc_for_bb(
+        instrs, use_saved=args.saved, args=[], live_ranges=live_ranges))
+    return result
+
+
+def main():
+    args = arg_parser.parse_args()
+    results = []
+    print("%9s %9s %9s %12s %12s %14s %8s" % ("registers", "instrs", "edges", "sweep", "all pairs", "alloc_for_bb", "growth"))
+    for size in args.sizes:
+        result = measure(size, args)
+        # how much the allocation time grew relative to the previous size
+        growth = ""
+        if len(results) != 0:
+            growth = "x%.2f" % (result["alloc_for_bb"] / results[-1]["alloc_for_bb"])
+        pairwise = "-" if result["pairwise"] is None else "%.4fs" % result["pairwise"]
+        print("%9d %9d %9d %11.4fs %12s %13.4fs %8s" % (result["registers"], result["instructions"], result["edges"],
+                                                     result["sweep"], pairwise, result["alloc_for_bb"], growth))
+        results.append(result)
+
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(OrderedDict([("window", args.window), ("saved", args.saved), ("results", results)]), fp, indent=2)
+
+if __name__ == "__main__":
+    main()
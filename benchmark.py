@@ -0,0 +1,153 @@
+from parser import parse_instructions
+from first_pass import find_functions, translate_function
+from mc_function import MCFunction
+from runner import allocate, emit_function
+from second_pass import parse_function
+from ir_optimizer import fold_constants, eliminate_dead_code
+import peephole
+from ir_generator import GeneratorConfig, write_program
+from collections import OrderedDict
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+# generated inputs, from about two thousand lines up to six million
+GENERATED_CASES = OrderedDict([
+    ("small", GeneratorConfig(functions=20, blocks=6, loop_depth=2, pressure=8, call_density=0.1)),
+    ("medium", GeneratorConfig(functions=200, blocks=12, loop_depth=2, pressure=16, call_density=0.1)),
+    ("large", GeneratorConfig(functions=2000, blocks=16, loop_depth=3, pressure=24, call_density=0.1)),
+    ("huge", GeneratorConfig(functions=20000, blocks=16, loop_depth=3, pressure=24, call_density=0.1)),
+])
+
+arg_parser = argparse.ArgumentParser(description='time every phase of the compiler on the test cases and on generated programs')
+arg_parser.add_argument('--allocator', type=str, nargs='+', default=['naive', 'local', 'global', 'linearscan'], help='the allocators to benchmark')
+arg_parser.add_argument('--cases', type=str, nargs='+', default=['tests', 'small', 'medium'], help='\'tests\' for test_cases/, or any of the generated sizes: %s' % ', '.join(GENERATED_CASES.keys()))
+arg_parser.add_argument('--input', type=str, nargs='*', default=[], help='extra IR files to benchmark')
+arg_parser.add_argument('--repeat', type=int, default=3, help='runs per input, the fastest of which is reported')
+arg_parser.add_argument('--saved', action='store_true', default=False)
+arg_parser.add_argument('--optimize', type=int, nargs='?', const=1, default=0, help='optimization level, as for runner')
+arg_parser.add_argument('--seed', type=int, default=0, help='seed of the generated programs')
+arg_parser.add_argument('--output', type=str, default='benchmark.json', help='JSON file the results are written to')
+
+TEST_CASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_cases")
+PHASES = ["parse", "ir_optimize", "instr_to_asm", "allocation", "parse_function", "peephole"]
+
+
+def time_compile(fname: str, allocator: str, saved=False, optimize=0) -> dict:
+    """
+    Compiles a file the same way runner does, timing every phase separately. Emitting the text of a function is counted as part of parse_function.
+
+    Returns:
+        - the time spent in each phase, and the size of the input and output
+    """
+    times = OrderedDict((phase, 0.0) for phase in PHASES)
+    start = time.perf_counter()
+    instructions = parse_instructions(fname)
+    functions = find_functions(instructions)
+    times["parse"] = time.perf_counter() - start
+
+    mc_instrs = 0
+    asm_lines = 0
+    for func in functions:
+        start = time.perf_counter()
+        if optimize >= 1:
+            fold_constants(func)
+            eliminate_dead_code(func)
+        folded = time.perf_counter()
+        translated = translate_function(func)
+        mc_function = MCFunction(name=func.name, args=func.args, int_arrs=func.int_arrs, instrs=translated)
+        mid = time.perf_counter()
+        allocate(mc_function, allocator, saved=saved)
+        end = time.perf_counter()
+        prologue, translated_body, epilogue, rtn = parse_function(mc_function, optimize=optimize)
+        second = time.perf_counter()
+        if optimize >= 2:
+            translated_body, _ = peephole.optimize(translated_body)
+        third = time.perf_counter()
+        text = emit_function(mc_function.name, prologue, translated_body, epilogue, rtn)
+        times["ir_optimize"] += folded - start
+        times["instr_to_asm"] += mid - folded
+        times["allocation"] += end - mid
+        times["parse_function"] += (second - end) + (time.perf_counter() - third)
+        times["peephole"] += third - second
+        mc_instrs += len(translated)
+        asm_lines += text.count("\n")
+
+    return OrderedDict([("ir_instructions", len(instructions)), ("functions", len(functions)),
+                        ("mc_instructions", mc_instrs), ("asm_lines", asm_lines), ("phases", times)])
+
+
+def benchmark(name: str, fname: str, allocator: str, args) -> dict:
+    best = None
+    for _ in range(args.repeat):
+        result = time_compile(fname, allocator, saved=args.saved, optimize=args.optimize)
+        if best is None or sum(result["phases"].values()) < sum(best["phases"].values()):
+            best = result
+
+    output = OrderedDict([("case", name), ("file", fname), ("allocator", allocator)])
+    output.update(best)
+    output["total"] = sum(best["phases"].values())
+    return output
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def get_inputs(args, tmpdir: str):
+    """
+    Lists the (case name, file) pairs to benchmark, writing the generated programs to tmpdir.
+    """
+    inputs = []
+    for case in args.cases:
+        if case == "tests":
+            for fname in sorted(glob.glob(os.path.join(TEST_CASES, "*", "*.ir"))):
+                inputs.append((os.path.basename(fname)[:-3], fname))
+        elif case in GENERATED_CASES:
+            fname = os.path.join(tmpdir, case + ".ir")
+            with open(fname, "w") as fp:
+                write_program(fp, GENERATED_CASES[case], args.seed)
+            inputs.append((case, fname))
+        else:
+            raise ValueError("Unexpected case: %s" % case)
+    for fname in args.input:
+        inputs.append((os.path.basename(fname), fname))
+    return inputs
+
+
+def main():
+    args = arg_parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, fname in get_inputs(args, tmpdir):
+            for allocator in args.allocator:
+                try:
+                    result = benchmark(name, fname, allocator, args)
+                except NotImplementedError as e:
+                    # e.g. the floating point test cases
+                    print("%-16s %-10s skipped: %s" % (name, allocator, e))
+                    break
+                results.append(result)
+                print("%-16s %-10s %8d instrs  " % (name, allocator, result["ir_instructions"]) +
+                      "  ".join("%s %.3fs" % (phase, t) for phase, t in result["phases"].items()))
+
+    report = OrderedDict([("commit", git_commit()), ("python", platform.python_version()),
+                          ("timestamp", time.strftime("%Y-%m-%dT%H:%M:%S")), ("seed", args.seed),
+                          ("repeat", args.repeat), ("saved", args.saved), ("optimize", args.optimize),
+                          ("generated", OrderedDict((case, config._asdict()) for case, config in GENERATED_CASES.items())),
+                          ("results", results)])
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+
+if __name__ == "__main__":
+    main()
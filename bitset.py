@@ -0,0 +1,8 @@
+def iter_bits(bits: int):
+    """
+    Yields the index of every set bit of an int bitset, lowest first.
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
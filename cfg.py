@@ -1,12 +1,36 @@
 from mc_instruction import MCInstruction
-from typing import List
+from typing import Dict, List, Set
+from collections import OrderedDict
 
 class CFG:
-    def __init__(self, instructions: List[MCInstruction]):
+    """
+    Control flow graph of a function. Blocks are numbered in program order (block 0 is the entry), and edges come from branches (target and fall-through), `j` and plain fall-through. A block ending in `ret` has no successors.
+
+    Args:
+        instructions: the body of the function
+        validate: check the structure of the graph after building it (defaults to CFG.validate)
+    """
+    # set by runner --validate
+    validate = False
+
+    def __init__(self, instructions: List[MCInstruction], validate=None):
         self.instructions = instructions
         self.bbs = self.get_blocks()
-
-    def get_blocks(self) -> List[List[MCInstruction]]:
+        self.entry = 0
+        self.labels = CFG.get_labels(self.bbs)
+        self.succs, self.preds = self.get_edges()
+        self.exits = [bbid for bbid in range(len(self.bbs)) if len(self.succs[bbid]) == 0]
+        self.rpo = self.get_rpo()
+        self.idoms = self.get_idoms()
+        self.loops = self.get_loops()
+        self.loop_depths = self.get_loop_depths()
+
+        if validate is None:
+            validate = CFG.validate
+        if validate:
+            self.check()
+
+    def get_blocks(self) -> Dict[int, List[MCInstruction]]:
         leaders = CFG.get_leaders(self.instructions)
 
         blocks = {}
@@ -19,56 +43,178 @@ class CFG:
             else:
                 end = leaders[i+1]
 
-            # blocks.append(self.instructions[start:end])
             blocks[bbid] = self.instructions[start:end]
             bbid += 1
 
-        # all instructions are in exactly one block
-        alls = []
-        for i, block1 in blocks.items():
-            alls += block1
-            for j, block2 in blocks.items():
-                if i != j:
-                    set1 = set(block1)
-                    set2 = set(block2)
-                    # if not set1.isdisjoint(set2):
-                        # for i in set1:
-                            # print(i)
-                        # print()
-                        # for i in set2:
-                            # print(i)
-                        # assert()
-                    assert(set1.isdisjoint(set2))
-
-        assert(len(alls) == len(self.instructions))
-
         return blocks
 
-
+    @staticmethod
+    def get_labels(bbs: Dict[int, List[MCInstruction]]) -> Dict[str, int]:
+        labels = {}
+        for bbid, bb in bbs.items():
+            if len(bb) > 0 and bb[0].is_label():
+                labels[bb[0].target] = bbid
+        return labels
+
+    def get_edges(self):
+        num = len(self.bbs)
+        succs = {bbid: [] for bbid in range(num)}
+        preds = {bbid: [] for bbid in range(num)}
+
+        for bbid in range(num):
+            bb = self.bbs[bbid]
+            last = bb[-1] if len(bb) > 0 else None
+            nexts = succs[bbid]
+            if last is not None and (last.is_branch() or last.is_jump()):
+                nexts.append(self.labels[last.target])
+
+            falls_through = last is None or not (last.is_jump() or last.is_return())
+            if falls_through and bbid + 1 < num and bbid + 1 not in nexts:
+                nexts.append(bbid + 1)
+
+            for succ in nexts:
+                preds[succ].append(bbid)
+
+        return succs, preds
+
+    def get_rpo(self) -> List[int]:
+        """
+        Reverse post-order of the blocks reachable from the entry.
+        """
+        if len(self.bbs) == 0:
+            return []
+
+        order = []
+        visited = {self.entry}
+        stack = [(self.entry, iter(self.succs[self.entry]))]
+        while len(stack) != 0:
+            bbid, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                order.append(bbid)
+            elif child not in visited:
+                visited.add(child)
+                stack.append((child, iter(self.succs[child])))
+
+        order.reverse()
+        return order
+
+    def get_idoms(self) -> Dict[int, int]:
+        """
+        Immediate dominator of every block reachable from the entry (the entry is its own), using the iterative algorithm of Cooper, Harvey and Kennedy over the reverse post-order.
+        """
+        if len(self.rpo) == 0:
+            return {}
+        order = {bbid: i for i, bbid in enumerate(self.rpo)}
+        idoms = {self.entry: self.entry}
+
+        def intersect(a, b):
+            while a != b:
+                while order[a] > order[b]:
+                    a = idoms[a]
+                while order[b] > order[a]:
+                    b = idoms[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for bbid in self.rpo[1:]:
+                new_idom = None
+                for pred in self.preds[bbid]:
+                    if pred not in idoms:
+                        continue
+                    new_idom = pred if new_idom is None else intersect(pred, new_idom)
+                if idoms.get(bbid) != new_idom:
+                    idoms[bbid] = new_idom
+                    changed = True
+        return idoms
+
+    def dominates(self, a: int, b: int) -> bool:
+        if b not in self.idoms:
+            return False
+        while b != a:
+            if b == self.entry:
+                return False
+            b = self.idoms[b]
+        return True
+
+    def get_loops(self) -> Dict[int, Set[int]]:
+        """
+        Finds the natural loops: an edge to a block that dominates its source is a back edge, and the loop of a header holds the header and every block that reaches the source of one of its back edges without passing through the header.
+
+        Returns:
+            an ordered map from loop header to the blocks in its loop
+        """
+        loops = OrderedDict()
+        for bbid in self.rpo:
+            for succ in self.succs[bbid]:
+                if not self.dominates(succ, bbid):
+                    continue
+                body = loops.setdefault(succ, {succ})
+                stack = [bbid]
+                while len(stack) != 0:
+                    block = stack.pop()
+                    if block in body:
+                        continue
+                    body.add(block)
+                    stack += [pred for pred in self.preds[block] if pred in self.idoms]
+        return loops
+
+    def get_loop_depths(self) -> Dict[int, int]:
+        """
+        Loop nesting depth of every block: the number of natural loops it is in.
+        """
+        depths = {bbid: 0 for bbid in self.bbs}
+        for body in self.loops.values():
+            for bbid in body:
+                depths[bbid] += 1
+        return depths
+
+    def check(self):
+        # all instructions are in exactly one block, in order
+        pos = 0
+        for bbid in range(len(self.bbs)):
+            for instr in self.bbs[bbid]:
+                assert(instr is self.instructions[pos])
+                pos += 1
+        assert(pos == len(self.instructions))
+
+        # control flow only leaves a block at its end, and the edges agree with each other
+        for bbid, bb in self.bbs.items():
+            for instr in bb[:-1]:
+                assert(not instr.is_branch() and not instr.is_jump() and not instr.is_return())
+            for succ in self.succs[bbid]:
+                assert(bbid in self.preds[succ])
+            for pred in self.preds[bbid]:
+                assert(bbid in self.succs[pred])
+
+        # a loop header dominates its whole loop
+        for header, body in self.loops.items():
+            for bbid in body:
+                assert(self.dominates(header, bbid))
 
     @staticmethod
-    def get_leaders(instructions: List[int]):
-        leaders = set()
-        targets = set()
+    def get_leaders(instructions: List[MCInstruction]) -> List[int]:
         num = len(instructions)
+        is_leader = [False] * num
+        targets = set()
 
-        leaders.add(0) # first instruction
+        if num != 0:
+            is_leader[0] = True # first instruction
 
         # add all the nexts and add the targets
         for i, instr in enumerate(instructions):
-            if instr.is_branch():
+            if instr.is_branch() or instr.is_jump() or instr.is_return():
                 next_instr = i + 1
                 if next_instr < num:
-                    leaders.add(next_instr)
-
-                targets.add(instr.target)
-            if instr.is_jump():
+                    is_leader[next_instr] = True
+            if instr.is_branch() or instr.is_jump():
                 targets.add(instr.target)
 
         for i, instr in enumerate(instructions):
-            if instr.op == "label" and instr.target in targets:
-                leaders.add(i)
+            if instr.is_label() and instr.target in targets:
+                is_leader[i] = True
 
-        leaders = list(leaders)
-        leaders.sort()
-        return leaders
+        return [i for i in range(num) if is_leader[i]]
@@ -0,0 +1,111 @@
+from function import Function
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# the modules whose code decides what a function compiles to, so changing any of them invalidates the cache
+COMPILER_MODULES = ["parser", "function", "ir_instruction", "ir_optimizer", "first_pass", "symbolic_map", "mc_instruction",
+                    "mc_function", "cfg", "bitset", "liveness", "allocator", "second_pass", "peephole", "runner"]
+
+
+def compiler_fingerprint() -> str:
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in COMPILER_MODULES:
+        with open(os.path.join(directory, module + ".py"), "rb") as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def function_text(function: Function) -> str:
+    """
+    Writes the IR of a function back out in a canonical form. Line numbers are left out, so moving a function around in its file does not change its text.
+    """
+    return "\n".join("%s %r" % (instr.op.value, instr.argument_list) for instr in function.instructions)
+
+
+class CompileCache:
+    """
+    Content-addressed on-disk cache of compiled functions. An entry is keyed by a hash of the IR of the function, the options it was compiled with and the compiler itself, and holds the assembly text of the function and its optimization statistics.
+
+    Entries are written atomically, and every hit refreshes the modification time of its file, so evict() can drop the entries that have not been used for longest.
+
+    Args:
+        directory: where the entries are stored (created if needed)
+        max_bytes: the size the cache is trimmed back to by evict()
+        max_age: the number of seconds an unused entry is kept
+    """
+    def __init__(self, directory: str, max_bytes: int, max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fingerprint = compiler_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, function: Function, allocator: str, saved: bool, optimize: int) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode())
+        digest.update(("%s %s %d\n" % (allocator, saved, optimize)).encode())
+        digest.update(function_text(function).encode())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, int]]]:
+        path = self.path(key)
+        try:
+            with open(path, "r") as fp:
+                entry = json.load(fp, object_pairs_hook=OrderedDict)
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, or left half written by a run that was killed
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["text"], entry["stats"]
+
+    def put(self, key: str, text: str, stats: Dict[str, int]):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as fp:
+            json.dump(OrderedDict([("text", text), ("stats", stats)]), fp)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Removes the entries that have not been used for max_age seconds, then the least recently used ones until the cache fits in max_bytes.
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+
+        now = time.time()
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def stats_line(self) -> str:
+        return "cache: %d hits, %d misses, %d evicted" % (self.hits, self.misses, self.evicted)
@@ -0,0 +1,57 @@
+import json
+import os
+import socket
+import sys
+
+# kept to the standard library modules the interpreter has loaded anyway, so the client starts as fast as python itself
+SOCKET_ENV = "TIGER_COMPILER_SOCKET"
+
+
+def default_socket() -> str:
+    """
+    The socket in a directory no other user can create files in: $XDG_RUNTIME_DIR, or else a per-user directory in /tmp that compile_server.py creates with mode 0700.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "tiger-compiler.sock")
+    return os.path.join("/tmp", "tiger-compiler-%d" % os.getuid(), "compiler.sock")
+
+
+def socket_path() -> str:
+    return os.environ.get(SOCKET_ENV) or default_socket()
+
+
+def request(path: str, argv) -> dict:
+    """
+    Sends one compile request (runner's command line arguments and the directory they are relative to) to the server and waits for its reply. The request is only sent to a socket this user owns, so another user can never see the arguments or forge the reply.
+    """
+    if os.stat(path).st_uid != os.getuid():
+        raise PermissionError("%s is owned by another user" % path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps({"argv": argv, "cwd": os.getcwd()}) + "\n").encode())
+        with sock.makefile("rb") as fp:
+            return json.loads(fp.readline())
+
+
+def main():
+    """
+    Takes the same arguments as runner.py, and has compile_server.py do the work when it is listening on $TIGER_COMPILER_SOCKET (or the default socket). Without a server, the file is compiled in this process instead.
+    """
+    argv = sys.argv[1:]
+    path = socket_path()
+    try:
+        reply = request(path, argv)
+    except (OSError, ValueError) as e:
+        if isinstance(e, PermissionError):
+            print("compile_client: not using %s: %s" % (path, e), file=sys.stderr)
+        import runner
+        runner.main(argv)
+        return
+
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    sys.exit(reply["status"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from compile_client import default_socket, socket_path
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+# imported here so every worker forked from the server starts with the compiler already loaded
+import runner
+
+# usage and errors are reported as if runner itself had been run
+runner.arg_parser.prog = "runner.py"
+
+arg_parser = argparse.ArgumentParser(description='keep the compiler loaded and serve compile requests from compile_client.py on a Unix socket')
+arg_parser.add_argument('--socket', type=str, default=None, help='socket to listen on (defaults to $TIGER_COMPILER_SOCKET, or a socket in $XDG_RUNTIME_DIR or a private per-user directory in /tmp)')
+arg_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of requests compiled at the same time')
+
+
+def compile_request(argv, cwd: str) -> dict:
+    """
+    Runs runner on one request in a worker process, capturing what it prints. Relative paths in the request are taken from the directory the client was run in.
+
+    Returns:
+        - the exit status, stdout and stderr of the run
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(cwd)
+            runner.main(argv)
+        except SystemExit as e:
+            # argparse errors and --help
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+    return {"status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            reply = self.server.pool.submit(compile_request, request["argv"], request["cwd"]).result()
+        except Exception:
+            reply = {"status": 1, "stdout": "", "stderr": traceback.format_exc()}
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Accepts every connection on its own thread, and hands the compile itself to a pool of worker processes, so several requests run at once without sharing the module level state of the compiler.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, workers: int):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        # the socket is created without group or other permissions, so only this user can connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, RequestHandler)
+        finally:
+            os.umask(umask)
+
+
+def private_directory(directory: str):
+    """
+    Creates the directory of the default socket with mode 0700, and checks that an existing one belongs to this user and is closed to everyone else, so no other user can have put a socket there first.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077 != 0:
+        raise ValueError("%s must be a directory only you can access" % directory)
+
+
+def remove_stale_socket(path: str):
+    if not os.path.exists(path):
+        return
+    if os.stat(path).st_uid != os.getuid():
+        raise ValueError("%s is owned by another user" % path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            # nothing is listening, it was left behind by a server that died
+            os.remove(path)
+            return
+    raise ValueError("A server is already listening on %s" % path)
+
+
+def main():
+    args = arg_parser.parse_args()
+    path = args.socket if args.socket is not None else socket_path()
+    if path == default_socket():
+        private_directory(os.path.dirname(path))
+    remove_stale_socket(path)
+
+    server = CompileServer(path, args.workers)
+    # stop cleanly on SIGTERM as well as ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
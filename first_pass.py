@@ -1,38 +1,168 @@
-from ir_instruction import IRInstruction
+from ir_instruction import IRInstruction, IROp, branch_taken
 from function import Function
 from mc_instruction import MCInstruction
 from parser import parse_instructions
 from symbolic_map import SymbolicMap
 import re
 
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 s_map = SymbolicMap()
 
-def is_constant(arg: str) -> bool:
-    pattern = r'^-?\d+.?\d*$'
-    return bool(re.compile(pattern).search(arg))
+def is_constant(arg) -> bool:
+    # the parser has already turned every constant operand into a number
+    return isinstance(arg, (int, float))
 
-def find_functions(instructions: List[IRInstruction]) -> List[List[IRInstruction]]:
-    output = []
+def find_functions(instructions: List[IRInstruction]) -> List[Function]:
+    return list(iter_functions(instructions))
 
+def iter_functions(instructions: Iterable[IRInstruction]) -> Iterator[Function]:
+    """
+    Groups instructions into functions, yielding each one as soon as its #end_function is seen so only one function is held at a time.
+    """
+    function_start, function_end = IROp.FUNCTION_START, IROp.FUNCTION_END
     inside_function = False
     curr_function = []
-    curr_name = None
     for instr in instructions:
-        if instr.instruction_type == "function_start":
+        if instr.op is function_start:
             inside_function = True
             curr_function = []
             curr_function.append(instr)
-        elif instr.instruction_type == "function_end":
+        elif instr.op is function_end:
             curr_function.append(instr)
             inside_function = False
-            output.append(Function(curr_function))
+            yield Function(curr_function)
+            curr_function = []
         else:
             curr_function.append(instr)
 
+
+def signed_magic(divisor: int) -> Tuple[int, int]:
+    """
+    Computes the magic number and shift that replace a signed 32 bit division by a constant with a multiply-high (Hacker's Delight, 10-1).
+
+    Args:
+        - divisor: the divisor, at least 2
+    Returns:
+        - the magic number (as a signed 32 bit value) and the shift amount
+    """
+    assert(divisor >= 2)
+    two31 = 1 << 31
+    anc = two31 - 1 - two31 % divisor
+    p = 31
+    q1, r1 = divmod(two31, anc)
+    q2, r2 = divmod(two31, divisor)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= divisor:
+            q2, r2 = q2 + 1, r2 - divisor
+        delta = divisor - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)):
+            break
+    magic = q2 + 1
+    if magic >= two31:
+        magic -= 1 << 32
+    return magic, p - 32
+
+def power_of_two(value: int) -> int:
+    """
+    Returns k if value is 2**k, otherwise -1.
+    """
+    if value > 0 and value & (value - 1) == 0:
+        return value.bit_length() - 1
+    return -1
+
+def shift_decomposition(magnitude: int) -> Optional[Tuple[str, int, int]]:
+    """
+    Writes a positive number as 2^a + 2^b or 2^a - 2^b.
+
+    Returns:
+        - ("addu" or "subu", a, b), or None if there is no such decomposition
+    """
+    high = magnitude.bit_length() - 1
+    low = magnitude - (1 << high)
+    if power_of_two(low) != -1:
+        return "addu", high, power_of_two(low)
+    if power_of_two((1 << (high + 1)) - magnitude) != -1:
+        return "subu", high + 1, power_of_two((1 << (high + 1)) - magnitude)
+    return None
+
+def reduces_multiply(constant: int) -> bool:
+    """
+    Checks whether convert_multiply_by_constant turns a multiply by this constant into shifts.
+    """
+    magnitude = abs(constant)
+    return magnitude <= 1 or power_of_two(magnitude) != -1 or shift_decomposition(magnitude) is not None
+
+def convert_multiply_by_constant(dest: str, src: str, constant: int) -> List[MCInstruction]:
+    """
+    Multiplies by a constant with shifts when the absolute value of the constant has at most two set bits, or is one power of two minus another. Returns an empty list for any other constant.
+    """
+    if not reduces_multiply(constant):
+        return []
+    magnitude = abs(constant)
+    output = []
+    if constant == 0:
+        return [MCInstruction("li", regs=[dest], imm=0)]
+    elif magnitude == 1:
+        output.append(MCInstruction("move", regs=[dest, src]))
+    elif power_of_two(magnitude) != -1:
+        output.append(MCInstruction("sll", regs=[dest, src], imm=power_of_two(magnitude)))
+    else:
+        op, high_shift, shift = shift_decomposition(magnitude)
+        temp0 = s_map["multiply_temp_reg0"]
+        output.append(MCInstruction("sll", regs=[temp0, src], imm=high_shift))
+        if shift == 0:
+            output.append(MCInstruction(op, regs=[dest, temp0, src]))
+        else:
+            temp1 = s_map["multiply_temp_reg1"]
+            output.append(MCInstruction("sll", regs=[temp1, src], imm=shift))
+            output.append(MCInstruction(op, regs=[dest, temp0, temp1]))
+
+    if constant < 0:
+        output.append(MCInstruction("subu", regs=[dest, "$zero", dest]))
     return output
 
+def convert_divide_by_constant(dest: str, src: str, constant: int) -> List[MCInstruction]:
+    """
+    Divides by a non-zero constant without a div, rounding towards zero like div does. A power of two becomes an arithmetic shift with the dividend biased by 2^k - 1 when it is negative, and any other divisor a multiply-high by its magic number followed by a shift and a sign correction.
+    """
+    assert(constant != 0)
+    temp0 = s_map["divide_temp_reg0"]
+    temp1 = s_map["divide_temp_reg1"]
+    magnitude = abs(constant)
+    k = power_of_two(magnitude)
+    output = []
+    if magnitude == 1:
+        output.append(MCInstruction("move", regs=[dest, src]))
+    elif k != -1:
+        if k == 1:
+            output.append(MCInstruction("srl", regs=[temp0, src], imm=31))
+        else:
+            output.append(MCInstruction("sra", regs=[temp0, src], imm=31))
+            output.append(MCInstruction("srl", regs=[temp0, temp0], imm=32 - k))
+        output.append(MCInstruction("addu", regs=[temp0, src, temp0]))
+        output.append(MCInstruction("sra", regs=[dest, temp0], imm=k))
+    else:
+        magic, shift = signed_magic(magnitude)
+        output.append(MCInstruction("li", regs=[temp0], imm=magic))
+        output.append(MCInstruction("mult", regs=[src, temp0]))
+        output.append(MCInstruction("mfhi", regs=[temp0]))
+        if magic < 0:
+            output.append(MCInstruction("addu", regs=[temp0, temp0, src]))
+        if shift != 0:
+            output.append(MCInstruction("sra", regs=[temp0, temp0], imm=shift))
+        # add one to round a negative quotient towards zero
+        output.append(MCInstruction("srl", regs=[temp1, src], imm=31))
+        output.append(MCInstruction("addu", regs=[dest, temp0, temp1]))
+
+    if constant < 0:
+        output.append(MCInstruction("subu", regs=[dest, "$zero", dest]))
+    return output
 
 def convert_arithmetic(instr: IRInstruction) -> str:
     """
@@ -45,35 +175,45 @@ def convert_arithmetic(instr: IRInstruction) -> str:
 
     dest, src0, src1 = instr.argument_list
     output = []
-    if instr.instruction_type == "add" or instr.instruction_type == "sub":
+    if instr.op is IROp.ADD or instr.op is IROp.SUB:
         if not is_constant(src0) and not is_constant(src1):
             # neither is constant
             output.append(MCInstruction(instr.instruction_type, regs=[dest, src0, src1]))
         elif not is_constant(src0) and is_constant(src1):
             # src1 is constant
             src1 = int(src1)
-            if instr.instruction_type == "add":
+            if instr.op is IROp.ADD:
                 output.append(MCInstruction("addi", regs=[dest, src0], imm=src1))
             else:
                 output.append(MCInstruction("addi", regs=[dest, src0], imm=-src1))
         elif is_constant(src0) and not is_constant(src1):
             # src0 is constant
             src = int(src0)
-            if instr.instruction_type == "add":
+            if instr.op is IROp.ADD:
                 output.append(MCInstruction("addi", regs=[dest, src1], imm=src0))
+            elif src == 0:
+                output.append(MCInstruction("subu", regs=[dest, "$zero", src1]))
             else:
-                output.append(MCInstruction("li", regs=[dest], imm=src0))
-                output.append(MCInstruction("sub", regs=[dest], imm=src1))
+                output.append(MCInstruction("li", regs=[s_map["subtract_temp_reg"]], imm=src0))
+                output.append(MCInstruction("sub", regs=[dest, s_map["subtract_temp_reg"], src1]))
         else:
             # both are constant
             src1 = int(src1)
             src0 = int(src0)
             output.append(MCInstruction("li", regs=[dest], imm=src0))
-            if instr.instruction_type == "add":
+            if instr.op is IROp.ADD:
                 output.append(MCInstruction("addi", regs=[dest], imm=src1))
             else:
                 output.append(MCInstruction("addi", regs=[dest], imm=-src1))
-    if instr.instruction_type == "mult":
+    if instr.op is IROp.MULT:
+        # multiplication commutes, so a constant on either side can be reduced
+        if isinstance(src1, int) and not is_constant(src0):
+            output = convert_multiply_by_constant(dest, src0, src1)
+        elif isinstance(src0, int) and not is_constant(src1):
+            output = convert_multiply_by_constant(dest, src1, src0)
+        if len(output) != 0:
+            return output
+
         if is_constant(src0):
             output.append(MCInstruction("li", regs=[s_map["multiply_temp_reg0"]], imm=src0))
             first_op = s_map["multiply_temp_reg0"]
@@ -87,7 +227,10 @@ def convert_arithmetic(instr: IRInstruction) -> str:
             second_op = src1
 
         output.append(MCInstruction("mul", regs=[dest, first_op, second_op]))
-    if instr.instruction_type == "div":
+    if instr.op is IROp.DIV:
+        if isinstance(src1, int) and src1 != 0 and not is_constant(src0):
+            return convert_divide_by_constant(dest, src0, src1)
+
         if is_constant(src0):
             output.append(MCInstruction("li", regs=[s_map["divide_temp_reg0"]], imm=src0))
             first_op = s_map["divide_temp_reg0"]
@@ -101,7 +244,7 @@ def convert_arithmetic(instr: IRInstruction) -> str:
             second_op = src1
 
         output.append(MCInstruction("div", regs=[dest, first_op, second_op]))
-    if instr.instruction_type in ["and", "or"]:
+    if instr.op in [IROp.AND, IROp.OR]:
         i_type = instr.instruction_type
         if not is_constant(src0) and not is_constant(src1):
             output.append(MCInstruction(i_type, regs=[dest, src0, src1]))
@@ -117,7 +260,7 @@ def convert_arithmetic(instr: IRInstruction) -> str:
 
 def convert_assignment(instr: IRInstruction) -> str:
     dest, src = instr.argument_list
-    assert(instr.instruction_type == "val_assign")
+    assert(instr.op is IROp.VAL_ASSIGN)
     assert(not is_constant(dest))
     
     if not is_constant(src):
@@ -128,7 +271,7 @@ def convert_assignment(instr: IRInstruction) -> str:
     return output
 
 def convert_branch(instr: IRInstruction, func) -> str:
-    if instr.instruction_type == "goto":
+    if instr.op is IROp.GOTO:
         target = instr.argument_list[0]
         return [MCInstruction("j", target="%s_%s" % (func, target))]
     else:
@@ -148,21 +291,22 @@ def convert_branch(instr: IRInstruction, func) -> str:
         elif is_constant(src0) and not is_constant(src1):
             output.append(MCInstruction("li", regs=[temp], imm=src0))
             output.append(MCInstruction(op, regs=[temp, src1], target="%s_%s" % (func, label)))
-        else:
-            raise ValueError("Both operands of branch instruction are constants")
+        elif branch_taken(instr.op, src0, src1):
+            # both are constant, so the branch is decided here
+            output.append(MCInstruction("j", target="%s_%s" % (func, label)))
         del s_map["CONVERT_BRANCH_TEMP_REG"]
 
         return output
 
 def convert_array_load_store(instr):
     # TODO: implement
-    assert(instr.instruction_type in ["array_store", "array_load"])
+    assert(instr.op in [IROp.ARRAY_STORE, IROp.ARRAY_LOAD])
     assert(len(instr.argument_list) == 3)
     val, array, index = instr.argument_list
     array = array
     output = []
 
-    if instr.instruction_type == "array_load":
+    if instr.op is IROp.ARRAY_LOAD:
         op = "lw"
     else:
         op = "sw"
@@ -197,47 +341,69 @@ def convert_array_load_store(instr):
     return output
 
 
+# constant sized array_assigns up to this many words become straight line stores
+ARRAY_ASSIGN_STRAIGHT_LINE = 16
+# words stored per iteration of the unrolled loop for larger constant sizes
+ARRAY_ASSIGN_UNROLL = 8
+
 def convert_array_assign(instr, func):
-    # TODO: implement
-    assert(instr.instruction_type == "array_assign")
+    """
+    Converts an array_assign (fill the first `size` words of an array with a value). A zero fill stores $zero directly. Small constant sizes become straight line stores, larger constant sizes an unrolled loop followed by the remaining stores, and a size only known at run time a three instruction loop over the addresses.
+    """
+    assert(instr.op is IROp.ARRAY_ASSIGN)
     assert(len(instr.argument_list) == 3)
     array, size, value = instr.argument_list
 
     num = func.curr_array_assign
     func.curr_array_assign += 1
-
-    # temp0 = s_map["array_assign_temp0"]
-    # temp1 = s_map["array_assign_temp1"]
-    # temp2 = s_map["array_assign_temp2"]
+    loop_label = func.name + "_array_assign_loop" + str(num)
+    end_label = func.name + "_array_assign_end" + str(num)
 
     output = []
 
-    index = s_map["array_assign_index"]
-    if is_constant(size):
-        output.append(MCInstruction("li", regs=[index], imm=size))
-    else:
-        output.append(MCInstruction("move", regs=[index, size]))
-
-    address = s_map["array_assign_address"]
-    output.append(MCInstruction("move", regs=[address, array]))
-
-    if is_constant(value):
+    if is_constant(value) and value == 0:
+        value = "$zero"
+    elif is_constant(value):
         val_reg = s_map["array_assign_value"]
         output.append(MCInstruction("li", regs=[val_reg], imm=value))
         value = val_reg
 
-    # continue from here
-    output.append(MCInstruction("label", target=func.name + "_array_assign_loop" + str(num)))
-    output.append(MCInstruction("blez", regs=[index], target=func.name+"_array_assign_end"+str(num)))
+    if is_constant(size) and size <= ARRAY_ASSIGN_STRAIGHT_LINE:
+        for i in range(int(size)):
+            output.append(MCInstruction("sw", regs=[value, array], offset=4*i))
+        return output
 
-    output.append(MCInstruction("sw", regs=[value, address], imm=0))
-    output.append(MCInstruction("addi", regs=[index, index], imm=-1))
-    output.append(MCInstruction("addiu", regs=[address, address], imm=4))
-    output.append(MCInstruction("j", target=func.name+"_array_assign_loop"+str(num)))
+    address = s_map["array_assign_address"]
+    end = s_map["array_assign_end"]
+    if is_constant(size):
+        size = int(size)
+        unrolled = size - size % ARRAY_ASSIGN_UNROLL
+        output.append(MCInstruction("move", regs=[address, array]))
+        output.append(MCInstruction("li", regs=[end], imm=4*unrolled))
+        output.append(MCInstruction("addu", regs=[end, end, array]))
+
+        # there is always at least one full iteration, so the test is at the bottom
+        output.append(MCInstruction("label", target=loop_label))
+        for i in range(ARRAY_ASSIGN_UNROLL):
+            output.append(MCInstruction("sw", regs=[value, address], offset=4*i))
+        output.append(MCInstruction("addiu", regs=[address, address], imm=4*ARRAY_ASSIGN_UNROLL))
+        output.append(MCInstruction("bne", regs=[address, end], target=loop_label))
+
+        for i in range(size - unrolled):
+            output.append(MCInstruction("sw", regs=[value, address], offset=4*i))
+        return output
 
-    output.append(MCInstruction("label", target=func.name+"_array_assign_end"+str(num)))
+    output.append(MCInstruction("move", regs=[address, array]))
+    output.append(MCInstruction("sll", regs=[end, size], imm=2))
+    output.append(MCInstruction("addu", regs=[end, end, array]))
+    output.append(MCInstruction("blez", regs=[size], target=end_label))
 
+    output.append(MCInstruction("label", target=loop_label))
+    output.append(MCInstruction("sw", regs=[value, address], offset=0))
+    output.append(MCInstruction("addiu", regs=[address, address], imm=4))
+    output.append(MCInstruction("bne", regs=[address, end], target=loop_label))
 
+    output.append(MCInstruction("label", target=end_label))
 
     # if is_constant(size) and is_constant(value):
         # output.append(MCInstruction("move", regs=[temp0, array]))
@@ -289,7 +455,7 @@ def convert_array_assign(instr, func):
     return output
 
 def convert_label(instr: IRInstruction, func):
-    assert(instr.instruction_type == "label")
+    assert(instr.op is IROp.LABEL)
     return [MCInstruction("label", target="%s_%s" % (func, instr.argument_list[0]))]
 
 def save_and_restore(reg_name: str) -> Tuple[List[MCInstruction], List[MCInstruction]]:
@@ -418,10 +584,10 @@ def convert_intrinsic(instr: IRInstruction, name: str, args: List[str], dest: st
 
 def convert_calls(instr: IRInstruction):
     # NOTE: this is temporary and should not ever end up in the final output
-    assert(instr.instruction_type == "call" or instr.instruction_type == "callr")
+    assert(instr.op is IROp.CALL or instr.op is IROp.CALLR)
     intrinsics = ["geti", "getf", "getc", "puti", "putf", "putc"]
     sp = "$sp"
-    if instr.instruction_type == "call":
+    if instr.op is IROp.CALL:
         function_name = instr.argument_list[0]
         arguments = instr.argument_list[1:]
         return_dest = None
@@ -467,7 +633,7 @@ def convert_calls(instr: IRInstruction):
     # the actual call itself
     output.append(MCInstruction("jal", target=function_name))
 
-    if instr.instruction_type == "callr":
+    if instr.op is IROp.CALLR:
         # reading the return value
         output.append(MCInstruction("move", regs=[return_dest, "$v0"])) # shouldn't have anything that doesn't fit in one word
 
@@ -478,7 +644,7 @@ def convert_calls(instr: IRInstruction):
     return save_arg + output + restore_arg
 
 def convert_return(instr):
-    assert(instr.instruction_type == "return")
+    assert(instr.op is IROp.RETURN)
     assert(len(instr.argument_list) == 1)
     ret_val = instr.argument_list[0]
     output = []
@@ -492,6 +658,18 @@ def convert_return(instr):
 
     return output
 
+def translate_function(function: Function) -> List[MCInstruction]:
+    """
+    Selects instructions for the body of a function. The symbolic temporaries are numbered from zero for every function, so the output for a function does not depend on which functions were translated before it.
+    """
+    global s_map
+    s_map = SymbolicMap()
+
+    translated = []
+    for instr in function.body():
+        translated += instr_to_asm(instr, function=function)
+    return translated
+
 def instr_to_asm(instr: IRInstruction, function=None) -> List[IRInstruction]:
     """
     Converts an IRInstruction object into assembly code string
@@ -500,17 +678,17 @@ def instr_to_asm(instr: IRInstruction, function=None) -> List[IRInstruction]:
     if instr.is_arithmetic():
         assert(not is_constant(instr.argument_list[0])) # dest can't be constant
         return convert_arithmetic(instr)
-    elif instr.instruction_type == "val_assign":
+    elif instr.op is IROp.VAL_ASSIGN:
         return convert_assignment(instr)
     elif instr.is_branch:
         return convert_branch(instr, func=function.name)
-    elif instr.instruction_type == "array_store" or instr.instruction_type == "array_load":
+    elif instr.op is IROp.ARRAY_STORE or instr.op is IROp.ARRAY_LOAD:
         return convert_array_load_store(instr)
-    elif instr.instruction_type == "array_assign":
+    elif instr.op is IROp.ARRAY_ASSIGN:
         return convert_array_assign(instr, func=function)
-    elif instr.instruction_type == "label":
+    elif instr.op is IROp.LABEL:
         return convert_label(instr, func=function.name)
-    elif instr.instruction_type in ["call", "callr"]:
+    elif instr.op in [IROp.CALL, IROp.CALLR]:
         return convert_calls(instr)
-    elif instr.instruction_type == "return":
+    elif instr.op is IROp.RETURN:
         return convert_return(instr)
@@ -1,5 +1,5 @@
 import re
-from ir_instruction import IRInstruction
+from ir_instruction import IRInstruction, IROp
 from typing import List
 
 class Function:
@@ -15,7 +15,7 @@ class Function:
 
         num_temps = 10
         self.saved_regs_count = len(self.int_vals) + len(self.int_arrs) - num_temps
-        self.has_array = len(self.int_arrs) == 0
+        self.has_array = len(self.int_arrs) != 0
         self.has_data = self.saved_regs_count != 0 or self.has_array
 
         if self.__is_leaf() and not self.has_data:
@@ -27,11 +27,11 @@ class Function:
 
     def __check_types(self):
         instructions = self.instructions
-        assert(instructions[0].instruction_type == "function_start")
-        assert(instructions[1].instruction_type == "function_def")
-        assert(instructions[2].instruction_type == "function_int_decl")
-        assert(instructions[3].instruction_type == "function_float_decl")
-        assert(instructions[-1].instruction_type == "function_end")
+        assert(instructions[0].op is IROp.FUNCTION_START)
+        assert(instructions[1].op is IROp.FUNCTION_DEF)
+        assert(instructions[2].op is IROp.FUNCTION_INT_DECL)
+        assert(instructions[3].op is IROp.FUNCTION_FLOAT_DECL)
+        assert(instructions[-1].op is IROp.FUNCTION_END)
 
     def __get_name(self):
         s = self.instructions[1].argument_list[0]
@@ -81,10 +81,10 @@ class Function:
 
     def __is_leaf(self):
         for i in self.instructions:
-            if i.instruction_type == "call" or i.instruction_type == "callr":
-                return True
+            if i.is_function_call():
+                return False
 
-        return False
+        return True
 
     def body(self):
         return self.instructions[4:-1]
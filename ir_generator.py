@@ -0,0 +1,178 @@
+import argparse
+import random
+import sys
+from typing import Iterator, NamedTuple
+
+arg_parser = argparse.ArgumentParser(description='generate a synthetic Tiger-IR program')
+arg_parser.add_argument('--output', type=str, default='-', help='output file (- for stdout)')
+arg_parser.add_argument('--seed', type=int, default=0)
+arg_parser.add_argument('--functions', type=int, default=10, help='number of functions, not counting main')
+arg_parser.add_argument('--blocks', type=int, default=8, help='number of top level regions (straight line, if/else or loop nest) per function')
+arg_parser.add_argument('--loop-depth', type=int, default=2, help='nesting depth of every loop nest')
+arg_parser.add_argument('--pressure', type=int, default=8, help='number of int locals every function computes with')
+arg_parser.add_argument('--call-density', type=float, default=0.1, help='probability that a statement is a call')
+arg_parser.add_argument('--statements', type=int, default=4, help='statements per straight line region')
+
+
+class GeneratorConfig(NamedTuple):
+    functions: int = 10
+    blocks: int = 8
+    loop_depth: int = 2
+    pressure: int = 8
+    call_density: float = 0.1
+    statements: int = 4
+
+
+# loops always run a small fixed number of times, so a generated program terminates when it is run
+TRIP_COUNT = 3
+ARITHMETIC = ["add", "sub", "mult", "and", "or"]
+BRANCHES = ["breq", "brneq", "brlt", "brgt", "brgeq", "brleq"]
+
+
+class IRGenerator:
+    """
+    Emits a random but valid Tiger-IR program, one line at a time, so arbitrarily large programs never have to be held in memory.
+
+    Every function computes over `pressure` int locals (all initialised on entry) and returns one of them. Calls only go to functions defined earlier, so the call graph has no cycles, and main calls every function once and prints its result. The same seed and config always give the same program.
+
+    Args:
+        config: the shape of the program
+        seed: the seed of the random number generator
+    """
+    def __init__(self, config: GeneratorConfig, seed: int=0):
+        assert(config.pressure >= 1)
+        self.config = config
+        self.rng = random.Random(seed)
+        # number of arguments of every function generated so far
+        self.arities = []
+
+    def lines(self) -> Iterator[str]:
+        for i in range(self.config.functions):
+            yield from self.function("f%d" % i)
+        yield from self.main()
+
+    def function(self, name: str) -> Iterator[str]:
+        rng = self.rng
+        config = self.config
+        num_args = rng.randint(0, 3)
+        self.args = ["p%d" % i for i in range(num_args)]
+        self.locals = ["x%d" % i for i in range(config.pressure)]
+        self.counters = ["i%d" % i for i in range(config.loop_depth)]
+        self.num_labels = 0
+
+        yield "#start_function"
+        yield "int %s(%s):" % (name, ", ".join("int " + arg for arg in self.args))
+        yield "int-list: " + ", ".join(self.locals + self.counters)
+        yield "float-list:"
+        for var in self.locals:
+            yield "    assign, %s, %d" % (var, rng.randint(0, 9))
+        for _ in range(config.blocks):
+            kind = rng.randrange(3)
+            if kind == 0:
+                yield from self.straight_line()
+            elif kind == 1:
+                yield from self.if_else()
+            else:
+                yield from self.loop_nest(0)
+        yield "    return, %s" % rng.choice(self.locals)
+        yield "#end_function"
+        yield ""
+        self.arities.append(num_args)
+
+    def main(self) -> Iterator[str]:
+        yield "#start_function"
+        yield "void main():"
+        yield "int-list: r"
+        yield "float-list:"
+        for i, arity in enumerate(self.arities):
+            args = [str(self.rng.randint(0, 9)) for _ in range(arity)]
+            yield "    callr, r, %s" % ", ".join(["f%d" % i] + args)
+            yield "    call, puti, r"
+            yield "    call, putc, 10"
+        yield "#end_function"
+
+    def label(self) -> str:
+        self.num_labels += 1
+        return "L%d" % self.num_labels
+
+    def operand(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.2:
+            return str(rng.randint(1, 9))
+        return rng.choice(self.locals + self.args)
+
+    def statement(self) -> str:
+        rng = self.rng
+        dest = rng.choice(self.locals)
+        if len(self.arities) != 0 and rng.random() < self.config.call_density:
+            callee = rng.randrange(len(self.arities))
+            args = [self.operand() for _ in range(self.arities[callee])]
+            return "    callr, %s" % ", ".join([dest, "f%d" % callee] + args)
+
+        choice = rng.random()
+        if choice < 0.15:
+            return "    assign, %s, %s" % (dest, self.operand())
+        if choice < 0.25:
+            # dividing by a non-zero constant keeps the program safe to run
+            return "    div, %s, %s, %d" % (dest, rng.choice(self.locals), rng.randint(1, 9))
+        return "    %s, %s, %s, %s" % (rng.choice(ARITHMETIC), dest, rng.choice(self.locals), self.operand())
+
+    def straight_line(self) -> Iterator[str]:
+        for _ in range(self.config.statements):
+            yield self.statement()
+
+    def if_else(self) -> Iterator[str]:
+        rng = self.rng
+        else_label = self.label()
+        end_label = self.label()
+        yield "    %s, %s, %s, %s" % (rng.choice(BRANCHES), else_label, rng.choice(self.locals), self.operand())
+        yield from self.straight_line()
+        yield "    goto, %s" % end_label
+        yield "%s:" % else_label
+        yield from self.straight_line()
+        yield "%s:" % end_label
+
+    def loop_nest(self, depth: int) -> Iterator[str]:
+        if depth == self.config.loop_depth:
+            yield from self.straight_line()
+            return
+
+        counter = self.counters[depth]
+        head = self.label()
+        exit = self.label()
+        yield "    assign, %s, 0" % counter
+        yield "%s:" % head
+        yield "    brgeq, %s, %s, %d" % (exit, counter, TRIP_COUNT)
+        yield from self.straight_line()
+        yield from self.loop_nest(depth + 1)
+        yield "    add, %s, %s, 1" % (counter, counter)
+        yield "    goto, %s" % head
+        yield "%s:" % exit
+
+
+def write_program(fp, config: GeneratorConfig, seed: int=0) -> int:
+    """
+    Writes a generated program to an open file.
+
+    Returns:
+        - the number of lines written
+    """
+    count = 0
+    for line in IRGenerator(config, seed).lines():
+        fp.write(line + "\n")
+        count += 1
+    return count
+
+
+def main():
+    args = arg_parser.parse_args()
+    config = GeneratorConfig(functions=args.functions, blocks=args.blocks, loop_depth=args.loop_depth,
+                             pressure=args.pressure, call_density=args.call_density, statements=args.statements)
+    if args.output == "-":
+        write_program(sys.stdout, config, args.seed)
+    else:
+        with open(args.output, "w") as fp:
+            write_program(fp, config, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -1,181 +1,190 @@
+from enum import Enum
+from typing import Optional
+import operator
+
+
+class IROp(Enum):
+    FUNCTION_START = "function_start"
+    FUNCTION_DEF = "function_def"
+    FUNCTION_INT_DECL = "function_int_decl"
+    FUNCTION_FLOAT_DECL = "function_float_decl"
+    FUNCTION_END = "function_end"
+    LABEL = "label"
+    VAL_ASSIGN = "val_assign"
+    ARRAY_ASSIGN = "array_assign"
+    ADD = "add"
+    SUB = "sub"
+    MULT = "mult"
+    DIV = "div"
+    AND = "and"
+    OR = "or"
+    GOTO = "goto"
+    BREQ = "breq"
+    BRNEQ = "brneq"
+    BRLT = "brlt"
+    BRGT = "brgt"
+    BRGEQ = "brgeq"
+    BRLEQ = "brleq"
+    RETURN = "return"
+    CALL = "call"
+    CALLR = "callr"
+    ARRAY_STORE = "array_store"
+    ARRAY_LOAD = "array_load"
+
+
+ARITHMETIC_OPS = frozenset([IROp.ADD, IROp.SUB, IROp.MULT, IROp.DIV, IROp.AND, IROp.OR])
+CONDITIONAL_BRANCH_OPS = frozenset([IROp.BREQ, IROp.BRNEQ, IROp.BRLT, IROp.BRGT, IROp.BRGEQ, IROp.BRLEQ])
+METADATA_OPS = frozenset([IROp.FUNCTION_START, IROp.FUNCTION_DEF, IROp.FUNCTION_END,
+                          IROp.FUNCTION_INT_DECL, IROp.FUNCTION_FLOAT_DECL])
+
+DEF_OPS = ARITHMETIC_OPS | frozenset([IROp.VAL_ASSIGN, IROp.CALLR, IROp.ARRAY_LOAD, IROp.ARRAY_ASSIGN])
+USE_OPS = ARITHMETIC_OPS | CONDITIONAL_BRANCH_OPS | frozenset([IROp.VAL_ASSIGN, IROp.RETURN, IROp.CALL, IROp.CALLR,
+                                                               IROp.ARRAY_STORE, IROp.ARRAY_LOAD, IROp.ARRAY_ASSIGN])
+CRITICAL_OPS = CONDITIONAL_BRANCH_OPS | METADATA_OPS | frozenset([IROp.GOTO, IROp.LABEL, IROp.CALL, IROp.CALLR,
+                                                                  IROp.ARRAY_LOAD, IROp.ARRAY_STORE, IROp.RETURN,
+                                                                  IROp.ARRAY_ASSIGN])
+BRANCH_OPS = CONDITIONAL_BRANCH_OPS | frozenset([IROp.GOTO])
+CALL_OPS = frozenset([IROp.CALL, IROp.CALLR])
+
+# which slice of the argument list holds the used operands
+USE_SLICES = {IROp.VAL_ASSIGN: slice(1, 2),
+              IROp.CALLR: slice(2, None),
+              IROp.CALL: slice(1, None),
+              IROp.ARRAY_STORE: slice(0, None), #NOTE: the last argument should always be a constant
+              IROp.RETURN: slice(0, 1),
+              IROp.ARRAY_LOAD: slice(1, None),
+              IROp.ARRAY_ASSIGN: slice(1, None)}
+for op in ARITHMETIC_OPS | CONDITIONAL_BRANCH_OPS:
+    USE_SLICES[op] = slice(1, 3)
+
+
+def wrap(value: int) -> int:
+    # ints are 32 bit two's complement on the target
+    return ((value + 0x80000000) & 0xffffffff) - 0x80000000
+
+def divide(a: int, b: int) -> Optional[int]:
+    if b == 0:
+        # left for the program to do at run time
+        return None
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+ARITHMETIC = {
+    IROp.ADD: operator.add,
+    IROp.SUB: operator.sub,
+    IROp.MULT: operator.mul,
+    IROp.DIV: divide,
+    IROp.AND: operator.and_,
+    IROp.OR: operator.or_,
+}
+
+BRANCHES = {
+    IROp.BREQ: operator.eq,
+    IROp.BRNEQ: operator.ne,
+    IROp.BRLT: operator.lt,
+    IROp.BRGT: operator.gt,
+    IROp.BRGEQ: operator.ge,
+    IROp.BRLEQ: operator.le,
+}
+
+
+def evaluate(op: IROp, a: int, b: int) -> Optional[int]:
+    """
+    Computes an arithmetic instruction on two int constants the way the target would.
+
+    Returns:
+        - the result, or None if it can only be computed at run time (division by zero)
+    """
+    value = ARITHMETIC[op](wrap(a), wrap(b))
+    if value is None:
+        return None
+    return wrap(value)
+
+def branch_taken(op: IROp, a: int, b: int) -> bool:
+    return BRANCHES[op](wrap(a), wrap(b))
+
+
 class IRInstruction:
+    """
+    A single Tiger-IR instruction. The properties of each opcode come from the tables above, so an instruction only stores its line, opcode and arguments.
+    """
+    __slots__ = ("line", "op", "argument_list")
+
     def __init__(self, line, instruction_type, argument_list):
         self.line = line
-        self.instruction_type = instruction_type
+        self.op = instruction_type if isinstance(instruction_type, IROp) else IROp(instruction_type)
         self.argument_list = argument_list
 
-        def_arr = ['val_assign',
-             'sub',
-             'add',
-             'mult',
-             'div',
-             'and',
-             'or',
-             'callr',
-             'array_load',
-             'array_assign']
-        use_arr = ['val_assign',
-             'sub',
-             'add',
-             'mult',
-             'div',
-             'and',
-             'or',
-             'breq',
-             'brneq',
-             'brlt',
-             'brgt',
-             'brleq',
-             'brgeq',
-             'return',
-             'call',
-             'callr',
-             'array_store',
-             'array_load',
-             'array_assign']
-        critical_arr = ['breq',
-                     'brneq',
-                     'brlt',
-                     'brgt',
-                     'brgeq',
-                     'brleq',
-                     'goto',
-                     'function_start',
-                     'function_def',
-                     'function_end',
-                     'function_int_decl',
-                     'function_float_decl',
-                     'label',
-                     'call',
-                     'callr',
-                     'array_load',
-                     'array_store',
-                     'return',
-                     'array_assign']
-        branch_arr = ['breq',
-                   'brneq',
-                   'brlt',
-                   'brgt',
-                   'brgeq',
-                   'brleq',
-                   'goto']
-
-        self.is_def = self.instruction_type in def_arr
-        self.is_use = self.instruction_type in use_arr
-        self.is_critical = self.instruction_type in critical_arr
-        self.is_branch = self.instruction_type in branch_arr
-        self.is_goto = self.instruction_type == "goto"
-        self.is_label = self.instruction_type == "label"
-
-        # self.succs = []
-        # self.preds = []
+    @property
+    def instruction_type(self):
+        return self.op.value
+
+    @property
+    def is_def(self):
+        return self.op in DEF_OPS
+
+    @property
+    def is_use(self):
+        return self.op in USE_OPS
+
+    @property
+    def is_critical(self):
+        return self.op in CRITICAL_OPS
+
+    @property
+    def is_branch(self):
+        return self.op in BRANCH_OPS
+
+    @property
+    def is_goto(self):
+        return self.op is IROp.GOTO
+
+    @property
+    def is_label(self):
+        return self.op is IROp.LABEL
 
     def is_metadata(self):
-        metadata = ["function_start", "function_def", "function_end",
-                    "function_int_decl", "function_float_decl"]
-        return self.instruction_type in metadata
+        return self.op in METADATA_OPS
 
     def does_kill(self, other_def):
         return self.argument_list[0] == other_def.argument_list[0]
 
     def get_uses(self):
-        binary_instructions = ['add', 'sub', 'mult', 'div', 'and', 'or']
-        branches = ['breq', 'brneq', 'brlt', 'brgt', 'brgeq', 'brleq']
-        if self.instruction_type == "val_assign":
-            return self.argument_list[1:2]
-        elif self.instruction_type in binary_instructions:
-            return self.argument_list[1:3]
-        elif self.instruction_type in branches:
-            return self.argument_list[1:3]
-        elif self.instruction_type == "callr":
-            return self.argument_list[2:]
-        elif self.instruction_type == "call":
-            return self.argument_list[1:]
-        elif self.instruction_type == "array_store":
-            return self.argument_list[:] #NOTE: the last argument should always be a constant
-        elif self.instruction_type == "return":
-            return self.argument_list[0:1]
-        elif self.instruction_type == "array_load":
-            return self.argument_list[1:]
-        elif self.instruction_type == "array_assign":
-            return self.argument_list[1:]
-        else:
+        use_slice = USE_SLICES.get(self.op)
+        if use_slice is None:
             return None
-    
-    #TODO: check if this actually works in place
-    def set_use(self, idx, arg):
-        binary_instructions = ['add', 'sub', 'mult', 'div', 'and', 'or']
-        branches = ['breq', 'brneq', 'brlt', 'brgt', 'brgeq', 'brleq']
-        # print("set use called on index: {}, arg: {}".format(idx, arg))
-        if self.instruction_type == "val_assign":
-            if idx != 0:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[1] = arg
-        elif self.instruction_type in binary_instructions:
-            if idx >= 2:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx+1] = arg
-        elif self.instruction_type in branches:
-            if idx >= 2:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx+1] = arg
-        elif self.instruction_type == "callr":
-            self.argument_list[idx+2] = arg
-        elif self.instruction_type == "call":
-            self.argument_list[idx+1] = arg
-        elif self.instruction_type == "array_store":
-            if idx >= 3:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx] = arg
-        elif self.instruction_type == "return":
-            if idx >= 1:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx] = arg
-        elif self.instruction_type == "array_load":
-            if idx >= 2:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx + 1] = arg
-        elif self.instruction_type == "array_assign":
-            if idx >= 3:
-                print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
-                  .format(self.__str__(), idx, arg))
-            else:
-                self.argument_list[idx] = arg
+        return self.argument_list[use_slice]
 
+    def set_use(self, idx, arg):
+        use_slice = USE_SLICES.get(self.op)
+        if use_slice is None:
+            return
+        start, stop, _ = use_slice.indices(len(self.argument_list))
+        if idx < 0 or start + idx >= stop:
+            print("set use out of bounds. instruction:{}, idx: {}, arg:{}"\
+              .format(self.__str__(), idx, arg))
+        else:
+            self.argument_list[start + idx] = arg
 
     def get_write_target(self):
-        has_target = ['val_assign', 'array_assign', 'sub', 'add', 'mult', 'div', 'and', 'or', 'callr', 'array_load']
-        if self.instruction_type in has_target:
-            return self.argument_list[0].strip()
+        if self.op in DEF_OPS:
+            return self.argument_list[0]
         else:
             return None
 
     def get_branch_target(self):
-        if self.is_branch:
+        if self.op in BRANCH_OPS:
             return self.argument_list[0]
-    
+
     def get_label(self):
-        if self.is_label:
+        if self.op is IROp.LABEL:
             return self.argument_list[0]
 
     def is_arithmetic(self):
-        arithmetics = ['add', 'sub', 'mult', 'div', 'and', 'or']
-        return self.instruction_type in arithmetics
+        return self.op in ARITHMETIC_OPS
 
     def is_function_call(self):
-        return self.instruction_type == "call" or self.instruction_type == "callr"
-    
+        return self.op in CALL_OPS
+
     def __str__(self):
         return "line number: {}, type: {}, argument_list: {}".format(self.line, self.instruction_type, self.argument_list)
@@ -0,0 +1,353 @@
+from ir_instruction import IRInstruction, IROp, ARITHMETIC_OPS, CONDITIONAL_BRANCH_OPS, USE_SLICES, evaluate, branch_taken
+from first_pass import power_of_two
+from function import Function
+from bitset import iter_bits
+from typing import Dict, List, Optional, Tuple
+
+
+def is_int(arg) -> bool:
+    return isinstance(arg, int)
+
+
+def get_blocks(body: List[IRInstruction]) -> List[List[IRInstruction]]:
+    """
+    Splits the body of a function into basic blocks. A label starts a block, and a branch, goto or return ends one.
+    """
+    blocks = [[]]
+    for instr in body:
+        if instr.op is IROp.LABEL and len(blocks[-1]) != 0:
+            blocks.append([])
+        blocks[-1].append(instr)
+        if instr.is_branch or instr.op is IROp.RETURN:
+            blocks.append([])
+    if len(blocks) > 1 and len(blocks[-1]) == 0:
+        blocks.pop()
+    return blocks
+
+def get_labels(blocks: List[List[IRInstruction]]) -> Dict[str, int]:
+    labels = {}
+    for bbid, block in enumerate(blocks):
+        if len(block) != 0 and block[0].op is IROp.LABEL:
+            labels[block[0].argument_list[0]] = bbid
+    return labels
+
+def get_succs(blocks: List[List[IRInstruction]], labels: Dict[str, int], bbid: int) -> Tuple[int, ...]:
+    """
+    The blocks control may reach from the end of a block.
+    """
+    block = blocks[bbid]
+    last = block[-1] if len(block) != 0 else None
+    fall_through = (bbid + 1,) if bbid + 1 < len(blocks) else ()
+    if last is None:
+        return fall_through
+    if last.op is IROp.GOTO:
+        return (labels[last.argument_list[0]],)
+    if last.op is IROp.RETURN:
+        return ()
+    if last.op in CONDITIONAL_BRANCH_OPS:
+        target = labels[last.argument_list[0]]
+        return tuple(dict.fromkeys((target,) + fall_through))
+    return fall_through
+
+
+def folds_into(op: IROp, index: int, value: int) -> bool:
+    """
+    Checks whether instruction selection handles a constant in this operand of an arithmetic instruction or branch (whose other operand is not constant) at least as cheaply as a register, so propagating into it never costs an extra li.
+    """
+    if op is IROp.ADD:
+        # addi sign extends its immediate
+        return -32768 <= value <= 32767
+    if op is IROp.SUB:
+        # subtracting a constant is an addi of its negation
+        return index == 2 and -32767 <= value <= 32768
+    if op is IROp.MULT:
+        # a single move, negation or sll (longer shift and add chains need more registers than they save)
+        return -1 <= value <= 1 or power_of_two(value) != -1
+    if op is IROp.DIV:
+        return index == 2 and value != 0
+    if op is IROp.AND or op is IROp.OR:
+        # andi and ori zero extend their immediate
+        return 0 <= value <= 0xffff
+    return False
+
+def substitute(instr: IRInstruction, state: Dict[str, int]) -> IRInstruction:
+    """
+    Replaces the used variables whose value is known with that value, wherever the constant is no more expensive than the register. Both operands of an arithmetic instruction or branch are replaced when both are known, so it can be folded.
+    """
+    use_slice = USE_SLICES.get(instr.op)
+    if use_slice is None or len(state) == 0:
+        return instr
+    op = instr.op
+    args = instr.argument_list
+    start, stop, _ = use_slice.indices(len(args))
+    known = {}
+    for i in range(start, stop):
+        value = state.get(args[i])
+        if value is not None:
+            known[i] = value
+
+    if op in ARITHMETIC_OPS or op in CONDITIONAL_BRANCH_OPS:
+        if not (is_int(known.get(1, args[1])) and is_int(known.get(2, args[2]))):
+            known = {i: value for i, value in known.items() if folds_into(op, i, value)}
+    elif op is IROp.ARRAY_STORE:
+        # a constant value to store has to be loaded into a register anyway
+        known.pop(0, None)
+
+    if len(known) == 0:
+        return instr
+    new_args = list(args)
+    for i, value in known.items():
+        new_args[i] = value
+    return IRInstruction(instr.line, op, new_args)
+
+def propagate_block(block: List[IRInstruction], state: Dict[str, int], tracked, labels: Dict[str, int],
+                    fall_through: Tuple[int, ...]) -> Tuple[List[IRInstruction], int, Optional[Tuple[int, ...]]]:
+    """
+    Runs a block forward from the constants known on entry, folding its instructions. The state is updated in place to the constants known on exit.
+
+    Returns:
+        - the folded block
+        - the number of instructions that were changed or removed
+        - the successors of the block if its branch was decided, otherwise None
+    """
+    output = []
+    changed = 0
+    decided = None
+    for instr in block:
+        new_instr = substitute(instr, state)
+        op = new_instr.op
+        args = new_instr.argument_list
+        if op in ARITHMETIC_OPS and is_int(args[1]) and is_int(args[2]):
+            value = evaluate(op, args[1], args[2])
+            if value is not None:
+                new_instr = IRInstruction(instr.line, IROp.VAL_ASSIGN, [args[0], value])
+        elif op in CONDITIONAL_BRANCH_OPS and is_int(args[1]) and is_int(args[2]):
+            if branch_taken(op, args[1], args[2]):
+                new_instr = IRInstruction(instr.line, IROp.GOTO, [args[0]])
+                decided = (labels[args[0]],)
+            else:
+                new_instr = None
+                decided = fall_through
+
+        if new_instr is not instr:
+            changed += 1
+        if new_instr is None:
+            continue
+        output.append(new_instr)
+
+        dest = new_instr.get_write_target()
+        if dest in tracked:
+            if new_instr.op is IROp.VAL_ASSIGN and is_int(new_instr.argument_list[1]):
+                state[dest] = new_instr.argument_list[1]
+            else:
+                state.pop(dest, None)
+
+    return output, changed, decided
+
+def meet(states: List[Dict[str, int]]) -> Dict[str, int]:
+    # a variable is only constant on entry to a block if every way in agrees on its value
+    if len(states) == 0:
+        return {}
+    output = dict(states[0])
+    for state in states[1:]:
+        for var, value in list(output.items()):
+            if state.get(var) != value:
+                del output[var]
+    return output
+
+
+def fold_constants(function: Function) -> int:
+    """
+    Folds constant expressions and propagates constants through the int variables of a function, within and across blocks. A variable is constant on entry to a block if it has the same value along every edge that can be taken, and a branch whose operands are both constant becomes a goto (or nothing), so the edge it never takes contributes nothing. Blocks that can never be reached are left as they are.
+
+    Args:
+        - function: the function to optimize, whose instructions are replaced
+    Returns:
+        - the number of instructions that were changed or removed
+    """
+    tracked = frozenset(function.int_vals)
+    blocks = get_blocks(function.body())
+    labels = get_labels(blocks)
+    num = len(blocks)
+    preds = [[] for _ in range(num)]
+    for bbid in range(num):
+        for succ in get_succs(blocks, labels, bbid):
+            preds[succ].append(bbid)
+
+    # out[bbid] is None until the block is found to be reachable, and feasible[bbid] holds the successors it can actually reach
+    outs = [None] * num
+    feasible = [()] * num
+
+    def entry_state(bbid: int) -> Dict[str, int]:
+        if bbid == 0:
+            return {}
+        return meet([outs[pred] for pred in preds[bbid] if outs[pred] is not None and bbid in feasible[pred]])
+
+    worklist = [0]
+    queued = {0}
+    while len(worklist) != 0:
+        bbid = worklist.pop()
+        queued.discard(bbid)
+        state = entry_state(bbid)
+        fall_through = (bbid + 1,) if bbid + 1 < num else ()
+        _, _, decided = propagate_block(blocks[bbid], state, tracked, labels, fall_through)
+        succs = decided if decided is not None else get_succs(blocks, labels, bbid)
+        if state != outs[bbid] or succs != feasible[bbid]:
+            outs[bbid] = state
+            feasible[bbid] = succs
+            for succ in succs:
+                if succ not in queued:
+                    worklist.append(succ)
+                    queued.add(succ)
+
+    body = []
+    changed = 0
+    for bbid in range(num):
+        if outs[bbid] is None:
+            body += blocks[bbid]
+            continue
+        fall_through = (bbid + 1,) if bbid + 1 < num else ()
+        block, block_changed, _ = propagate_block(blocks[bbid], entry_state(bbid), tracked, labels, fall_through)
+        body += block
+        changed += block_changed
+
+    instructions = function.instructions
+    function.instructions = instructions[:4] + body + instructions[-1:]
+    return changed
+
+
+def reachable_blocks(blocks: List[List[IRInstruction]], labels: Dict[str, int]) -> List[int]:
+    """
+    The blocks reachable from the entry, in program order.
+    """
+    if len(blocks) == 0:
+        return []
+    seen = {0}
+    stack = [0]
+    while len(stack) != 0:
+        for succ in get_succs(blocks, labels, stack.pop()):
+            if succ not in seen:
+                seen.add(succ)
+                stack.append(succ)
+    return sorted(seen)
+
+def reaching_definitions(blocks: List[List[IRInstruction]], labels: Dict[str, int]) -> Tuple[List[List[int]], List[IRInstruction], Dict[str, int]]:
+    """
+    Solves reaching definitions over the blocks of a function. Every definition is given an integer id, and every set of definitions is an int bitset over those ids.
+
+    Returns:
+        - per block, per instruction, the definitions reaching the point right before it
+        - the instruction of every definition id
+        - per variable, the bitset of its definitions
+    """
+    num = len(blocks)
+    defs = []
+    var_defs = {}
+    def_ids = []
+    for block in blocks:
+        block_ids = []
+        for instr in block:
+            dest = instr.get_write_target()
+            if dest is None:
+                block_ids.append(None)
+                continue
+            block_ids.append(len(defs))
+            var_defs[dest] = var_defs.get(dest, 0) | (1 << len(defs))
+            defs.append(instr)
+        def_ids.append(block_ids)
+
+    gen = [0] * num
+    kill = [0] * num
+    for bbid in range(num):
+        for instr, def_id in zip(blocks[bbid], def_ids[bbid]):
+            if def_id is None:
+                continue
+            others = var_defs[instr.get_write_target()]
+            gen[bbid] = (gen[bbid] & ~others) | (1 << def_id)
+            kill[bbid] |= others
+
+    preds = [[] for _ in range(num)]
+    for bbid in range(num):
+        for succ in get_succs(blocks, labels, bbid):
+            preds[succ].append(bbid)
+
+    reach_in = [0] * num
+    reach_out = [0] * num
+    worklist = list(range(num - 1, -1, -1))
+    queued = set(worklist)
+    while len(worklist) != 0:
+        bbid = worklist.pop()
+        queued.discard(bbid)
+        new_in = 0
+        for pred in preds[bbid]:
+            new_in |= reach_out[pred]
+        reach_in[bbid] = new_in
+        new_out = gen[bbid] | (new_in & ~kill[bbid])
+        if new_out != reach_out[bbid]:
+            reach_out[bbid] = new_out
+            for succ in get_succs(blocks, labels, bbid):
+                if succ not in queued:
+                    worklist.append(succ)
+                    queued.add(succ)
+
+    points = []
+    for bbid in range(num):
+        reaching = reach_in[bbid]
+        block_points = []
+        for instr, def_id in zip(blocks[bbid], def_ids[bbid]):
+            block_points.append(reaching)
+            if def_id is not None:
+                reaching = (reaching & ~var_defs[instr.get_write_target()]) | (1 << def_id)
+        points.append(block_points)
+
+    return points, defs, var_defs
+
+
+def eliminate_dead_code(function: Function) -> int:
+    """
+    Removes the blocks that can never be reached, then the definitions whose value can never be used. Critical instructions (branches, labels, calls, array accesses and returns) are marked live, and so, transitively, is every definition that reaches a use in a live instruction. Anything left unmarked is swept.
+
+    Args:
+        - function: the function to optimize, whose instructions are replaced
+    Returns:
+        - the number of instructions removed
+    """
+    blocks = get_blocks(function.body())
+    labels = get_labels(blocks)
+    size = sum(len(block) for block in blocks)
+    blocks = [blocks[bbid] for bbid in reachable_blocks(blocks, labels)]
+    labels = get_labels(blocks)
+
+    points, defs, var_defs = reaching_definitions(blocks, labels)
+    location = {}
+    for bbid, block in enumerate(blocks):
+        for i, instr in enumerate(block):
+            location[id(instr)] = (bbid, i)
+
+    marked = set()
+    worklist = []
+    for block in blocks:
+        for instr in block:
+            if instr.is_critical:
+                marked.add(id(instr))
+                worklist.append(instr)
+    while len(worklist) != 0:
+        instr = worklist.pop()
+        uses = instr.get_uses()
+        if uses is None:
+            continue
+        bbid, i = location[id(instr)]
+        reaching = points[bbid][i]
+        for use in uses:
+            if use not in var_defs:
+                continue
+            for def_id in iter_bits(reaching & var_defs[use]):
+                definition = defs[def_id]
+                if id(definition) not in marked:
+                    marked.add(id(definition))
+                    worklist.append(definition)
+
+    body = [instr for block in blocks for instr in block if id(instr) in marked]
+    instructions = function.instructions
+    function.instructions = instructions[:4] + body + instructions[-1:]
+    return size - len(body)
@@ -0,0 +1,217 @@
+from typing import Dict, List, Optional, Set, Tuple
+from collections import OrderedDict
+from mc_instruction import MCInstruction
+from cfg import CFG
+from bitset import iter_bits
+import re
+
+# anything named with a $ is a physical register ($t0, $sp, $zero, ...)
+PHYSICAL_PATTERN = re.compile(r"\$\w+")
+
+# a reference inside a loop counts this many times more than one just outside it
+LOOP_WEIGHT = 10
+
+def should_map(reg: str, args: List[str]):
+    not_physical = PHYSICAL_PATTERN.match(reg) is None
+    not_arg = reg not in args
+
+    return not_physical and not_arg
+
+def number_regs(instrs: List[MCInstruction], args: List[str], reg_ids: Dict[str, int], regs: List[str]) -> List[Tuple[List[int], List[int]]]:
+    """
+    Gives every virtual register in the instructions an integer id (extending reg_ids and regs in place) and returns the (use ids, def ids) of each instruction.
+    """
+    output = []
+    for instr in instrs:
+        if instr.regs is None:
+            output.append(([], []))
+            continue
+        ids = []
+        for reg_list in (instr.get_uses(), instr.get_defs()):
+            reg_list_ids = []
+            for reg in reg_list:
+                if should_map(reg, args):
+                    if reg not in reg_ids:
+                        reg_ids[reg] = len(regs)
+                        regs.append(reg)
+                    reg_list_ids.append(reg_ids[reg])
+            ids.append(reg_list_ids)
+        output.append((ids[0], ids[1]))
+    return output
+
+class Liveness:
+    """
+    Global liveness analysis over the basic blocks of a CFG.
+
+    Every virtual register of the function is given an integer id once, and every live set is a python int used as a bitset over those ids. Block live-in/live-out sets are solved with a backward worklist, and the live set at each program point of a block is computed on demand with a single backward pass over that block.
+
+    Args:
+        cfg: the CFG of the function
+        args: the function arguments (these are never mapped, so they are never tracked)
+    """
+    def __init__(self, cfg: CFG, args: List[str]):
+        self.cfg = cfg
+        self.args = args
+        self.regs = []
+        self.reg_ids = {}
+
+        # per block, per instruction: (use ids, def ids)
+        self.instr_regs = {}
+        self.gen = {}
+        self.kill = {}
+        for bbid in sorted(cfg.bbs.keys()):
+            self.instr_regs[bbid] = number_regs(cfg.bbs[bbid], args, self.reg_ids, self.regs)
+            self.gen[bbid], self.kill[bbid] = self.__gen_and_kill(bbid)
+
+        self.live_in, self.live_out = self.__solve()
+
+    def __gen_and_kill(self, bbid: int) -> Tuple[int, int]:
+        gen = 0
+        kill = 0
+        for uses, defs in reversed(self.instr_regs[bbid]):
+            for reg in defs:
+                gen &= ~(1 << reg)
+                kill |= 1 << reg
+            for reg in uses:
+                gen |= 1 << reg
+        return gen, kill
+
+    def __solve(self) -> Tuple[Dict[int, int], Dict[int, int]]:
+        sorted_keys = sorted(self.cfg.bbs.keys())
+        succs = self.cfg.succs
+        preds = self.cfg.preds
+
+        live_in = {bbid: 0 for bbid in sorted_keys}
+        live_out = {bbid: 0 for bbid in sorted_keys}
+
+        # blocks are popped from the end, so the first pass visits them in post-order
+        reachable = set(self.cfg.rpo)
+        worklist = [bbid for bbid in sorted_keys if bbid not in reachable] + self.cfg.rpo
+        on_list = set(sorted_keys)
+        while len(worklist) != 0:
+            bbid = worklist.pop()
+            on_list.discard(bbid)
+
+            out = 0
+            for succ in succs[bbid]:
+                out |= live_in[succ]
+            live_out[bbid] = out
+
+            new_in = self.gen[bbid] | (out & ~self.kill[bbid])
+            if new_in != live_in[bbid]:
+                live_in[bbid] = new_in
+                for pred in preds[bbid]:
+                    if pred not in on_list:
+                        worklist.append(pred)
+                        on_list.add(pred)
+
+        return live_in, live_out
+
+    def block_weight(self, bbid: int) -> int:
+        return LOOP_WEIGHT ** self.cfg.loop_depths[bbid]
+
+    def spill_costs(self) -> List[int]:
+        """
+        Estimates the cost of spilling every register in one pass over the function: each use and definition counts LOOP_WEIGHT to the power of the loop nesting depth of its block.
+        """
+        costs = [0] * len(self.regs)
+        for bbid in sorted(self.cfg.bbs.keys()):
+            weight = self.block_weight(bbid)
+            for uses, defs in self.instr_regs[bbid]:
+                for reg in uses:
+                    costs[reg] += weight
+                for reg in defs:
+                    costs[reg] += weight
+        return costs
+
+    def names(self, bits: int) -> Set[str]:
+        return {self.regs[reg] for reg in iter_bits(bits)}
+
+    def live_in_regs(self, bbid: int) -> Set[str]:
+        return self.names(self.live_in[bbid])
+
+    def live_out_regs(self, bbid: int) -> Set[str]:
+        return self.names(self.live_out[bbid])
+
+    def def_regs(self, bbid: int) -> Set[str]:
+        return self.names(self.kill[bbid])
+
+    def live_points(self, bbid: int) -> List[int]:
+        """
+        Computes the live set at every program point of a block. Index i is the point right before instruction i, and the last index is the point after the block (its live-out set).
+
+        Returns:
+            a list of bitsets of length len(block) + 1
+        """
+        instrs = self.cfg.bbs[bbid]
+        instr_regs = self.instr_regs[bbid]
+        points = [0] * (len(instr_regs) + 1)
+        live = self.live_out[bbid]
+        points[-1] = live
+        for i in range(len(instr_regs) - 1, -1, -1):
+            uses, defs = instr_regs[i]
+            if instrs[i].is_return():
+                live = 0
+            for reg in defs:
+                live &= ~(1 << reg)
+            for reg in uses:
+                live |= 1 << reg
+            points[i] = live
+        return points
+
+    def live_ranges(self, bbid: int) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        Computes the live range of every virtual register in a block using the global live-out set of the block.
+        """
+        return Liveness.ranges_from(self.cfg.bbs[bbid], self.instr_regs[bbid], self.live_out[bbid], self.regs)
+
+    @staticmethod
+    def ranges_from(instrs: List[MCInstruction], instr_regs: List[Tuple[List[int], List[int]]], live_out: int, regs: List[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        Computes the live range (first and last live program point) of every register in a block with one backward pass. A definition always occupies the point right after it, even if the value is dead, so that it interferes with everything live across it.
+
+        Args:
+            instrs: the instructions of the block
+            instr_regs: the (use ids, def ids) of every instruction in the block
+            live_out: the bitset of registers live after the block
+            regs: the name of every register id
+
+        Returns:
+            an ordered map from register name to (start, end), or None if it is never live
+        """
+        num = len(instr_regs)
+        starts = {}
+        ends = {}
+        for reg in iter_bits(live_out):
+            ends[reg] = num
+
+        live = live_out
+        for i in range(num - 1, -1, -1):
+            uses, defs = instr_regs[i]
+            if instrs[i].is_return():
+                live = 0
+            for reg in defs:
+                live &= ~(1 << reg)
+                starts[reg] = i + 1
+                if reg not in ends:
+                    ends[reg] = i + 1
+            for reg in uses:
+                live |= 1 << reg
+                starts[reg] = i
+                if reg not in ends:
+                    ends[reg] = i
+
+        for reg in iter_bits(live):
+            starts[reg] = 0
+
+        live_ranges = OrderedDict()
+        for uses, defs in instr_regs:
+            for reg in uses + defs:
+                name = regs[reg]
+                if name not in live_ranges:
+                    if reg in starts:
+                        live_ranges[name] = starts[reg], ends[reg]
+                    else:
+                        live_ranges[name] = None
+
+        return live_ranges
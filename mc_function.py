@@ -10,6 +10,9 @@ class MCFunction:
         self.body = instrs
         self.bbs = None
         self.reg_maps = None
+        self.resident = {}
+        self.liveness = None
+        self.stack_type = None
 
 
     def num_vars(self):
@@ -25,17 +28,31 @@ class MCFunction:
     def set_bbs(self, bbs):
         self.bbs = bbs
         self.calls_others = MCFunction.calls_others(bbs)
+        self.saves_args = MCFunction.saves_args(bbs)
         if self.reg_maps is not None:
             self.has_data = self.has_data()
+            self.stack_type = self.get_stack_type()
 
-    def set_reg_maps(self, reg_maps):
+    def set_reg_maps(self, reg_maps, resident=None):
+        """
+        Args:
+            reg_maps: the register map of every block
+            resident: the virtual registers that keep the same physical register in every block, so they are never loaded or saved at block boundaries
+        """
         self.reg_maps = reg_maps
+        self.resident = resident if resident is not None else {}
         self.saved_regs = MCFunction.get_saved_regs(self.reg_maps)
         self.spill_regs = MCFunction.get_spill_regs(self.reg_maps)
+        # arguments past the fourth are spilled by the second pass, so they also need the spill temporaries
+        self.temp_regs = MCFunction.get_temp_regs(self.reg_maps, self.body, len(self.spill_regs) != 0 or len(self.args) > 4)
         self.num_vars = self.num_vars()
         self.int_vals = MCFunction.get_int_vals(reg_maps)
         if self.bbs is not None:
             self.has_data = self.has_data()
+            self.stack_type = self.get_stack_type()
+
+    def set_liveness(self, liveness):
+        self.liveness = liveness
 
     def has_data(self):
         assert(self.saved_regs is not None)
@@ -50,6 +67,17 @@ class MCFunction:
         # else:
             # return "simple leaf"
 
+    def get_stack_type(self):
+        """
+        Classifies the function once it is allocated: "nonleaf" if it calls other functions, "data_leaf" if it needs stack slots for spills, arrays, argument registers saved around intrinsics or arguments past the fourth, and "simple_leaf" otherwise.
+        """
+        if self.calls_others:
+            return "nonleaf"
+        elif len(self.spill_regs) != 0 or len(self.int_arrs) != 0 or len(self.args) > 4 or self.saves_args:
+            return "data_leaf"
+        else:
+            return "simple_leaf"
+
     @staticmethod
     def get_saved_regs(reg_maps):
         saved_regs = set()
@@ -62,6 +90,28 @@ class MCFunction:
         output.sort()
         return output
 
+    @staticmethod
+    def get_temp_regs(reg_maps, body, spills):
+        """
+        Finds the t registers the function may write: the ones the register maps use, any named directly in the body, and the spill temporaries ($t7-$t9) if anything is spilled.
+        """
+        temp_regs = set()
+        temp_pattern = re.compile(r"\$t\d$")
+        for _, reg_map in reg_maps.items():
+            for _, reg in reg_map.items():
+                if temp_pattern.match(reg):
+                    temp_regs.add(reg)
+        for instr in body:
+            if instr.regs is not None:
+                for reg in instr.regs:
+                    if temp_pattern.match(reg):
+                        temp_regs.add(reg)
+        if spills:
+            temp_regs.update(["$t7", "$t8", "$t9"])
+        output = list(temp_regs)
+        output.sort()
+        return output
+
     @staticmethod
     def get_spill_regs(reg_maps):
         spill_regs = set()
@@ -80,6 +130,15 @@ class MCFunction:
 
         return False
 
+    @staticmethod
+    def saves_args(bbs):
+        for bbid, bb in bbs.items():
+            for instr in bb:
+                if instr.op == "save_arg":
+                    return True
+
+        return False
+
     @staticmethod
     def get_int_vals(reg_maps):
         int_vals = set()
@@ -1,14 +1,50 @@
-from typing import List
-
-
-RWMEM = ['lb', 'lw', 'sb', 'sw']
-branches = ['beq', 'blt', 'bgt', 'ble', 'bge', 'bne', 'blez']
+from typing import NamedTuple, Tuple
+
+
+class OpInfo(NamedTuple):
+    defs: slice     # the register operands written
+    uses: slice     # the register operands read
+    template: str   # how the instruction is printed
+
+
+NONE = slice(0, 0)
+FIRST = slice(0, 1)
+REST = slice(1, None)
+ALL = slice(0, None)
+
+# keyed by mnemonic; templates: "mem" prints a load/store, "label" a label, "bare" just the opcode, "branch"/"plain" registers, then the immediate, then the target
+OP_INFO = {}
+for op in ["add", "addi", "addu", "addiu", "sub", "subu", "div", "mul",
+           "and", "andi", "or", "ori", "sll", "srl", "sra", "move", "li"]:
+    OP_INFO[op] = OpInfo(FIRST, REST, "plain")
+# mult only writes hi/lo, which mfhi then reads
+OP_INFO["mult"] = OpInfo(NONE, ALL, "plain")
+OP_INFO["mfhi"] = OpInfo(FIRST, NONE, "plain")
+OP_INFO["lb"] = OpInfo(FIRST, REST, "mem")
+OP_INFO["lw"] = OpInfo(FIRST, REST, "mem")
+OP_INFO["sb"] = OpInfo(NONE, ALL, "mem")
+OP_INFO["sw"] = OpInfo(NONE, ALL, "mem")
+for op in ["beq", "bne", "blt", "bgt", "ble", "bge", "blez"]:
+    OP_INFO[op] = OpInfo(NONE, ALL, "branch")
+# ret, call and callr are pseudo instructions that never reach the output
+for op in ["j", "jr", "jal", "syscall", "ret", "call", "callr"]:
+    OP_INFO[op] = OpInfo(NONE, ALL, "plain")
+OP_INFO["label"] = OpInfo(NONE, NONE, "label")
+OP_INFO["noop"] = OpInfo(NONE, NONE, "bare")
+# saving and restoring argument registers is not a def or use of a virtual register
+OP_INFO["save_arg"] = OpInfo(NONE, NONE, "plain")
+OP_INFO["restore_arg"] = OpInfo(NONE, NONE, "plain")
 
 class MCInstruction:
-    def __init__(self, op, regs=None, imm=None, offset=None, target=None,
-                 function_name=None, arguments=None, return_dest=None, is_call_move=False):
-        self.op = self._formatOp(op)
-        self.regs = self._formatRegs(regs)
+    __slots__ = ("op", "info", "regs", "_defs", "_uses", "imm", "offset", "target", "is_call_move")
+
+    def __init__(self, op, regs=None, imm=None, offset=None, target=None, is_call_move=False):
+        op = op.lower()
+        if op not in OP_INFO:
+            raise ValueError("Unexpected opcode: %s" % op)
+        self.info = OP_INFO[op]
+        self.op = op
+        self.set_regs(self._formatRegs(regs))
         self.imm = imm
         self.offset = offset
         self.target = target
@@ -16,42 +52,45 @@ class MCInstruction:
 
     def __str__(self):
         # NOTE: call and callr should never remain in the final output, so their string representation is mostly for debugging
-        if self.op == "call":
-            assert(self.function_name is not None)
-            assert(self.arguments is not None)
-            return "call:\n\
-                    function_name: {}, arguments:{}".format(self.function_name, self.arguments)
-        if self.op == "callr":
-            assert(self.function_name is not None)
-            assert(self.arguments is not None)
-            assert(self.return_dest is not None)
-            return "callr:\n\
-                    return_dest: {}, function_name: {}, arguments:{}".format(self.return_dest, self.function_name, self.arguments)
-        if self.op == 'label':
+        template = self.info.template
+        op = self.op
+        if template == "label":
             return self.target + ':'
-        if self.op == 'noop':
-            return self.op
-        if self.op in RWMEM:
+        if template == "bare":
+            return op
+        if template == "mem":
             if self.offset:
-                return '\t{} {}, {}({})'.format(self.op, self.regs[0], self.offset, self.regs[1]) 
+                return '\t{} {}, {}({})'.format(op, self.regs[0], self.offset, self.regs[1])
             else:
-                return '\t{} {}, ({})'.format(self.op, self.regs[0], self.regs[1]) 
-        outstr = "\t" + self.op
+                return '\t{} {}, ({})'.format(op, self.regs[0], self.regs[1])
+        outstr = "\t" + op
         if self.regs != None:
             outstr += ' ' + ', '.join(self.regs)
         if self.imm != None:
             outstr += ', ' + str(self.imm)
         if self.target != None:
-            if self.op in branches:
+            if template == "branch":
                 outstr += ', ' + self.target
             else:
                 outstr += ' ' + self.target
         return outstr
 
-    def _formatOp(self, op):
-        if op == None:
-            return op
-        return op.lower()
+    def set_regs(self, regs):
+        """
+        Replaces the register operands. Always assign regs through this method, as it drops the cached defs and uses.
+        """
+        self.regs = regs
+        self._defs = None
+        self._uses = None
+
+    def _split_regs(self):
+        # split out on the first query, so later queries never allocate and instructions that are never queried pay nothing
+        if self.regs:
+            self._defs = tuple(self.regs[self.info.defs])
+            self._uses = tuple(self.regs[self.info.uses])
+        else:
+            self._defs = ()
+            self._uses = ()
 
     def _formatRegs(self, reg):
         if reg == None:
@@ -60,80 +99,27 @@ class MCInstruction:
             return [r for r in reg]
         return reg
 
-    def get_defs(self) -> List[str]:
-        if self.regs is None or self.regs == []:
-            return []
-        if self.op == "save_arg" or self.op == "restore_arg":
-            return []
-        # only assign for now
-        triples = ["add", "addi", "addu", "addiu",
-                   "sub", "subu",
-                   "div", "mul",
-                   "and", "andi",
-                   "or", "ori",
-                   "sll"]
-
-        doubles = ["move", "li"]
-
-        mems = ["sw", "lw"]
-
-        branches = ["beq", "bne", "blt", "bgt", "bge", "ble", "blez"]
-
-        jumps = ["j", "jr"]
-
-
-        if self.op in triples:
-            return self.regs[0:1]
-        elif self.op in doubles:
-            return self.regs[0:1]
-        elif self.op in mems:
-            return []
-        elif self.op in branches:
-            return []
-        elif self.op in jumps:
-            return []
-        else:
-            raise ValueError("unexpected value for get_defs()")
-
-    def get_uses(self) -> List[str]:
-        if self.regs is None or self.regs == []:
-            return []
-        if self.op == "save_arg" or self.op == "restore_arg":
-            return []
-        # only assign for now
-        triples = ["add", "addi", "addu", "addiu",
-                   "sub", "subu",
-                   "div", "mul",
-                   "and", "andi",
-                   "or", "ori",
-                   "sll"]
-
-        doubles = ["move", "li"]
-
-        mems = ["sw", "lw"]
-
-        branches = ["beq", "bne", "blt", "bgt", "bge", "ble", "blez"]
-
-        jumps = ["j", "jr"]
-
-
-        if self.op in triples:
-            return self.regs[1:]
-        elif self.op in doubles:
-            return self.regs[1:]
-        elif self.op in mems:
-            return self.regs
-        elif self.op in branches:
-            return self.regs
-        elif self.op in jumps:
-            return self.regs
-        else:
-            print(self.op)
-            raise ValueError("unexpected value for get_uses()")
+    def get_defs(self) -> Tuple[str, ...]:
+        if self._defs is None:
+            self._split_regs()
+        return self._defs
+
+    def get_uses(self) -> Tuple[str, ...]:
+        if self._uses is None:
+            self._split_regs()
+        return self._uses
+
+    def reads(self, reg: str) -> bool:
+        return reg in self.get_uses()
 
     def is_branch(self) -> bool:
-        return self.op in branches
+        return self.info.template == "branch"
 
     def is_jump(self) -> bool:
         return self.op == "j" # jal and jr shouldn't matter here, since they are function level
 
+    def is_label(self) -> bool:
+        return self.op == "label"
+
+    def is_return(self) -> bool:
+        return self.op == "ret"
@@ -1,40 +1,92 @@
 import re
-from ir_instruction import IRInstruction
+import sys
+from ir_instruction import IRInstruction, IROp
 
 
 def parse_instructions(fp):
-    function_regex = r'^.+ .+(.*):$'
-    instructions = []
+    return list(iter_instructions(fp))
+
+
+# operands that look like numbers are constants, everything else names a variable, label or function
+NUMBER = re.compile(r'-?\d+(\.\d*)?$')
+
+# opcode -> instruction type (assign is told apart by its number of operands)
+OPCODES = {
+    "add": IROp.ADD, "sub": IROp.SUB, "mult": IROp.MULT, "div": IROp.DIV, "and": IROp.AND, "or": IROp.OR,
+    "goto": IROp.GOTO,
+    "breq": IROp.BREQ, "brneq": IROp.BRNEQ, "brlt": IROp.BRLT, "brgt": IROp.BRGT, "brgeq": IROp.BRGEQ, "brleq": IROp.BRLEQ,
+    "return": IROp.RETURN, "call": IROp.CALL, "callr": IROp.CALLR,
+    "array_store": IROp.ARRAY_STORE, "array_load": IROp.ARRAY_LOAD,
+}
+ASSIGN_TYPES = {2: IROp.VAL_ASSIGN, 3: IROp.ARRAY_ASSIGN}
+
+# lines that start with one of these keywords are function structure, not instructions
+DIRECTIVES = {
+    "#start_function": lambda line: (IROp.FUNCTION_START, []),
+    "#end_function": lambda line: (IROp.FUNCTION_END, []),
+    "int-list:": lambda line: (IROp.FUNCTION_INT_DECL, get_variables(line)),
+    "float-list:": lambda line: (IROp.FUNCTION_FLOAT_DECL, get_variables(line)),
+}
+
+
+def parse_operand(token: str):
+    """
+    Parses an operand once: integer (and float) literals become numbers, and anything else becomes an interned string, so later passes never have to look at the text again.
+    """
+    match = NUMBER.match(token)
+    if match is None:
+        return sys.intern(token)
+    if match.group(1) is None:
+        return int(token)
+    return float(token)
+
+
+def parse_line(line_num: int, line: str):
+    """
+    Parses a single line of IR.
+
+    Returns:
+        - the IRInstruction on the line, or None if the line is blank
+    """
+    stripped = line.strip()
+    if stripped == "":
+        return None
+
+    keyword = stripped.split(None, 1)[0]
+    if keyword in DIRECTIVES:
+        instruction_type, argument_list = DIRECTIVES[keyword](line)
+        return IRInstruction(line_num, instruction_type, argument_list)
+
+    if stripped.endswith(":"):
+        if "(" in stripped:
+            return IRInstruction(line_num, IROp.FUNCTION_DEF, [line])
+        return IRInstruction(line_num, IROp.LABEL, [sys.intern(stripped[:-1].strip())])
+
+    tokens = [token.strip() for token in stripped.split(",")]
+    opcode = tokens[0]
+    argument_list = [parse_operand(token) for token in tokens[1:]]
+    if opcode == "assign":
+        instruction_type = ASSIGN_TYPES.get(len(argument_list))
+    else:
+        instruction_type = OPCODES.get(opcode)
+    if instruction_type is None:
+        raise ValueError("Unexpected instruction on line %d: %s" % (line_num, stripped))
+
+    return IRInstruction(line_num, instruction_type, argument_list)
+
+
+def iter_instructions(fp):
+    """
+    Parses the IR file one line at a time, yielding each instruction as soon as it is read.
+    """
     with open(fp, 'r') as file:
         line_num = 0
         for line in file:
-            if "#start_function" in line:
-                instructions.append(IRInstruction(line_num, "function_start", []))
-            elif "#end_function" in line:
-                instructions.append(IRInstruction(line_num, "function_end", []))
-            elif "int-list:" in line:
-                instructions.append(IRInstruction(line_num, "function_int_decl", get_variables(line)))
-            elif "float-list:" in line:
-                instructions.append(IRInstruction(line_num, "function_float_decl", get_variables(line)))
-            elif re.match(function_regex, line) != None:
-                instructions.append(IRInstruction(line_num, "function_def", [line]))
-            elif ":" in line:
-                instructions.append(IRInstruction(line_num, "label", [line[len(line) - len(line.strip()) - 1 : line.find(":")]]))
-            elif "assign" in line:
-                arg_list = get_arguments(line)
-                if len(arg_list) == 2:
-                    instructions.append(IRInstruction(line_num, "val_assign", arg_list))
-                elif len(arg_list) == 3:
-                    instructions.append(IRInstruction(line_num, "array_assign", arg_list))
-            elif line.strip() == "" :
+            instr = parse_line(line_num, line)
+            if instr is None:
                 continue
-            else:
-                # opcode = line[len(line) - len(line.strip()) - 1 : line.find(',')]
-                opcode = line[len(line) - len(line.lstrip()): line.find(",")]
-                arg_list = get_arguments(line)
-                instructions.append(IRInstruction(line_num, opcode, arg_list))
+            yield instr
             line_num += 1
-    return instructions
 
 
 def get_functions(instructions):
@@ -61,10 +113,6 @@ def flatten_functions(functions):
     return instructions
 
 
-def get_arguments(line):
-    return [arg.strip() for arg in line.split(", ")[1:]]
-
-
 def get_variables(line):
     colon_index = line.find(":")
     if colon_index != -1:
@@ -0,0 +1,123 @@
+from typing import List, Optional, Tuple
+from mc_instruction import MCInstruction
+
+
+def same_slot(a: MCInstruction, b: MCInstruction) -> bool:
+    return a.regs[1] == b.regs[1] and (a.offset or 0) == (b.offset or 0)
+
+def ends_window(instr: MCInstruction) -> bool:
+    # control flow may reach or leave the code after these, so nothing is known about the registers past them
+    return instr.is_label() or instr.is_branch() or instr.is_jump() or instr.op in ("jal", "jr", "syscall")
+
+def is_dead_after(instrs: List[MCInstruction], start: int, reg: str) -> bool:
+    """
+    Checks whether the value of a physical register is overwritten before it is read again, looking forward from instrs[start] up to the end of the straight line code.
+    """
+    for i in range(start, len(instrs)):
+        instr = instrs[i]
+        if ends_window(instr):
+            return False
+        if reg in instr.get_uses():
+            return False
+        if reg in instr.get_defs():
+            return True
+    return False
+
+
+# every rule looks at the instructions starting at i, and returns how many of them it replaces and with what, or None if it does not apply
+
+def store_then_load(instrs: List[MCInstruction], i: int) -> Optional[Tuple[int, List[MCInstruction]]]:
+    """
+    sw $tX, off($fp)
+    lw $tX, off($fp)    <- the register already holds the value
+    """
+    a, b = instrs[i], instrs[i+1]
+    if a.op == "sw" and b.op == "lw" and a.regs[0] == b.regs[0] and same_slot(a, b):
+        return 2, [a]
+    return None
+
+def load_then_store(instrs: List[MCInstruction], i: int) -> Optional[Tuple[int, List[MCInstruction]]]:
+    """
+    lw $tX, off($fp)
+    sw $tX, off($fp)    <- the slot already holds the value
+    """
+    a, b = instrs[i], instrs[i+1]
+    if a.op == "lw" and b.op == "sw" and a.regs[0] == b.regs[0] and a.regs[0] != a.regs[1] and same_slot(a, b):
+        return 2, [a]
+    return None
+
+def self_move(instrs: List[MCInstruction], i: int) -> Optional[Tuple[int, List[MCInstruction]]]:
+    """
+    move $tX, $tX
+    """
+    a = instrs[i]
+    if a.op == "move" and a.regs[0] == a.regs[1]:
+        return 1, []
+    return None
+
+def load_immediate_then_move(instrs: List[MCInstruction], i: int) -> Optional[Tuple[int, List[MCInstruction]]]:
+    """
+    li $tX, imm
+    move $tY, $tX       <- becomes li $tY, imm when $tX is dead afterwards
+    """
+    a, b = instrs[i], instrs[i+1]
+    if a.op == "li" and b.op == "move" and b.regs[1] == a.regs[0] and b.regs[0] != a.regs[0] \
+            and is_dead_after(instrs, i + 2, a.regs[0]):
+        return 2, [MCInstruction("li", regs=[b.regs[0]], imm=a.imm)]
+    return None
+
+def jump_to_next(instrs: List[MCInstruction], i: int) -> Optional[Tuple[int, List[MCInstruction]]]:
+    """
+    j label             <- falls through to the label anyway
+    label:
+    """
+    a = instrs[i]
+    if not a.is_jump():
+        return None
+    for j in range(i + 1, len(instrs)):
+        if not instrs[j].is_label():
+            return None
+        if instrs[j].target == a.target:
+            return 1, []
+    return None
+
+# (rule, number of instructions it needs to see)
+RULES = [(self_move, 1), (jump_to_next, 1), (store_then_load, 2), (load_then_store, 2), (load_immediate_then_move, 2)]
+
+
+def peephole_pass(instrs: List[MCInstruction]) -> List[MCInstruction]:
+    output = []
+    i = 0
+    while i < len(instrs):
+        for rule, window in RULES:
+            if i + window > len(instrs):
+                continue
+            rewrite = rule(instrs, i)
+            if rewrite is not None:
+                consumed, replacement = rewrite
+                output += replacement
+                i += consumed
+                break
+        else:
+            output.append(instrs[i])
+            i += 1
+    return output
+
+
+def optimize(instrs: List[MCInstruction]) -> Tuple[List[MCInstruction], int]:
+    """
+    Slides a window over the machine code of a function and applies the rewrite rules until none of them applies anymore. Every rule only looks at physical registers and frame slots, so this runs on the output of parse_function.
+
+    Args:
+        - instrs: the instructions to optimize
+    Returns:
+        - the optimized instructions and the number of instructions removed
+    """
+    size = len(instrs)
+    while True:
+        new_instrs = peephole_pass(instrs)
+        changed = len(new_instrs) != len(instrs) or any(a is not b for a, b in zip(new_instrs, instrs))
+        instrs = new_instrs
+        if not changed:
+            break
+    return instrs, size - len(instrs)
@@ -1,96 +1,329 @@
-from parser import parse_instructions
-from first_pass import find_functions, instr_to_asm
-from allocator import get_live_ranges, NaiveAllocator, LocalAllocator
+from parser import parse_instructions, iter_instructions
+from first_pass import find_functions, iter_functions, translate_function
+from allocator import get_live_ranges, remove_coalesced_moves, NaiveAllocator, LocalAllocator, GlobalAllocator, LinearScanAllocator
 from second_pass import parse_function
+from ir_optimizer import fold_constants, eliminate_dead_code
+import peephole
+from compile_cache import CompileCache
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import deque, OrderedDict
+from typing import Dict, List, Tuple
 import argparse
+import functools
+import json
+import os
 import pprint
+from function import Function
 from mc_function import MCFunction
 import re
+import sys
+import time
 
 from cfg import CFG
 
 arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument('--allocator', type=str, default='naive', help='the type of register allocation to perform (\'naive\' or \'local\')')
+arg_parser.add_argument('--allocator', type=str, default='naive', help='the type of register allocation to perform (\'naive\', \'local\', \'global\' or \'linearscan\')')
 arg_parser.add_argument('--input', type=str, help='input file')
 arg_parser.add_argument('--output', type=str, default='out.s', help='output file')
-arg_parser.add_argument('--optimize', action='store_true', default=False)
+arg_parser.add_argument('--optimize', type=int, nargs='?', const=1, default=0, help='optimization level: 1 folds and propagates constants, removes dead code and skips needless spill loads and saves, 2 also runs the peephole optimizer (--optimize alone is level 1)')
+arg_parser.add_argument('--report', action='store_true', default=False, help='print what the optimizations did to every function on stderr')
 arg_parser.add_argument('--saved', action='store_true', default=False)
+arg_parser.add_argument('--validate', action='store_true', default=False, help='check the structure of every CFG that is built')
+arg_parser.add_argument('--jobs', type=int, default=1, help='number of worker processes compiling functions in parallel')
+arg_parser.add_argument('--stream', action='store_true', default=False, help='compile and write one function at a time instead of reading the whole file first')
+arg_parser.add_argument('--cache-dir', type=str, default=None, help='directory of the compiled function cache (no caching without it)')
+arg_parser.add_argument('--cache-max-size', type=float, default=256, help='size in MB the cache is trimmed back to after every run')
+arg_parser.add_argument('--cache-max-age', type=float, default=30, help='days an unused cache entry is kept')
+arg_parser.add_argument('--batch', type=str, nargs='+', default=None, help='compile many .ir files (or every .ir file below a directory) in one run, one file per worker process, instead of --input')
+arg_parser.add_argument('--output-dir', type=str, default='out', help='directory the assembly of a batch is written to')
+arg_parser.add_argument('--summary', type=str, default=None, help='JSON file the per file summary of a batch is written to (default: summary.json in the output directory)')
 
 
-def main():
-    args = arg_parser.parse_args()
+def allocate(function: MCFunction, allocator: str, saved=False) -> int:
+    """
+    Allocates registers for a function with the given allocator, then deletes the moves it coalesced.
+
+    Returns:
+        the number of moves deleted
+    """
+    if allocator == "naive":
+        NaiveAllocator(function).map_function()
+    elif allocator == "local":
+        LocalAllocator(function, use_saved=saved).map_function()
+    elif allocator == "global":
+        GlobalAllocator(function, use_saved=saved).map_function()
+    elif allocator == "linearscan":
+        LinearScanAllocator(function, use_saved=saved).map_function()
+    else:
+        raise ValueError("Unexpected allocator: %s" % allocator)
+    return remove_coalesced_moves(function)
+
+
+def emit_function(name: str, prologue, translated_body, epilogue, rtn) -> str:
+    lines = [name + ":\n"]
+    for i in prologue:
+        lines.append("\t%s\n" % i)
+    lines.append("\n")
+
+    for i in translated_body:
+        lines.append("\t%s\n" % i)
+    lines.append("\n")
+
+    for i in epilogue:
+        lines.append("\t%s\n" % i)
+    lines.append("\n")
+
+    for i in rtn:
+        lines.append("\t%s\n" % i)
+
+    return "".join(lines)
+
+
+def compile_function(func: Function, allocator: str, saved=False, optimize=0) -> Tuple[str, Dict[str, int]]:
+    """
+    Runs constant folding and dead code elimination (from optimization level 1), instruction selection, register allocation (deleting the moves it coalesced), the second pass and (from optimization level 2) the peephole optimizer on one function.
+
+    Returns:
+        the assembly text of the function, and the statistics of the optimizations that ran
+    """
+    stats = OrderedDict()
+    if optimize >= 1:
+        stats["constants_folded"] = fold_constants(func)
+        stats["dead_removed"] = eliminate_dead_code(func)
+    translated = translate_function(func)
+    mc_function = MCFunction(name=func.name, args=func.args, int_arrs=func.int_arrs, instrs=translated)
+    stats["moves_removed"] = allocate(mc_function, allocator, saved=saved)
+    stats["spilled"] = len(mc_function.spill_regs)
+    prologue, translated_body, epilogue, rtn = parse_function(mc_function, optimize=optimize)
+    if optimize >= 2:
+        translated_body, stats["peephole_removed"] = peephole.optimize(translated_body)
+    return emit_function(mc_function.name, prologue, translated_body, epilogue, rtn), stats
+
+
+def init_worker(validate):
+    CFG.validate = validate
+
+
+def compile_functions(functions, args, cache: CompileCache=None):
+    """
+    Compiles every function, in a process pool when more than one job is requested, yielding the assembly and statistics of each in the original function order. Only a bounded window of functions is in flight at once, so a streamed input is never read far ahead of the output. Functions found in the cache are not compiled again, and every function that is compiled is added to it.
+    """
+    compile_one = functools.partial(compile_function, allocator=args.allocator, saved=args.saved, optimize=args.optimize)
+
+    def lookup(func):
+        # the key has to be taken before compiling, as the IR passes rewrite the function
+        if cache is None:
+            return None, None
+        key = cache.key(func, args.allocator, args.saved, args.optimize)
+        return key, cache.get(key)
+
+    def finish(key, result):
+        if isinstance(result, Future):
+            result = result.result()
+            if key is not None:
+                cache.put(key, *result)
+        return result
+
+    if args.jobs <= 1:
+        for func in functions:
+            key, cached = lookup(func)
+            if cached is not None:
+                yield cached
+                continue
+            result = compile_one(func)
+            if key is not None:
+                cache.put(key, *result)
+            yield result
+        return
+
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(args.validate,)) as pool:
+        pending = deque()
+        for func in functions:
+            key, cached = lookup(func)
+            pending.append((key, cached if cached is not None else pool.submit(compile_one, func)))
+            if len(pending) >= 2 * args.jobs:
+                yield finish(*pending.popleft())
+        while len(pending) != 0:
+            yield finish(*pending.popleft())
+
+
+def count_instructions(text: str) -> int:
+    # instructions are indented twice, labels once
+    return sum(1 for line in text.split("\n") if line.startswith("\t\t"))
+
+
+def batch_inputs(paths: List[str]) -> List[Tuple[str, str]]:
+    """
+    Expands the paths of a batch into the files to compile. A directory stands for every .ir file below it, and its layout is kept in the output directory.
+
+    Returns:
+        the (input file, output file relative to the output directory) of every file, in order
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".ir"):
+                        fname = os.path.join(root, name)
+                        inputs.append((fname, os.path.relpath(fname, path)[:-len(".ir")] + ".s"))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.splitext(os.path.basename(path))[0] + ".s"))
+        else:
+            raise ValueError("batch input %s does not exist" % path)
+
+    outputs = {}
+    for fname, output in inputs:
+        if output in outputs:
+            raise ValueError("%s and %s would both be written to %s" % (outputs[output], fname, output))
+        outputs[output] = fname
+    return inputs
+
+
+def compile_file(fname: str, output: str, args) -> Dict:
+    """
+    Compiles one file of a batch, in this process, into the given output file. A file that fails to compile is reported rather than raised, so one bad file does not stop the batch.
+
+    Returns:
+        the summary of the file: whether it compiled, how long it took, the number of functions, spilled registers and emitted instructions, and the totals of the optimization statistics
+    """
+    start = time.perf_counter()
+    summary = OrderedDict([("input", fname), ("output", output)])
+    cache = None
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, max_bytes=int(args.cache_max_size * 1024 * 1024), max_age=args.cache_max_age * 24 * 3600)
+
+    try:
+        functions = find_functions(parse_instructions(fname))
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        totals = OrderedDict()
+        instructions = 0
+        with open(output, "w") as outfile:
+            outfile.write(".text\n")
+            for text, stats in compile_functions(functions, args, cache=cache):
+                outfile.write(text)
+                instructions += count_instructions(text)
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + value
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = "%s: %s" % (type(e).__name__, e)
+        summary["seconds"] = time.perf_counter() - start
+        # leave no half written output behind
+        if os.path.exists(output):
+            os.remove(output)
+        return summary
+
+    summary["status"] = "ok"
+    summary["seconds"] = time.perf_counter() - start
+    summary["functions"] = len(functions)
+    summary["spilled"] = totals.get("spilled", 0)
+    summary["instructions"] = instructions
+    summary["stats"] = totals
+    if cache is not None:
+        summary["cache_hits"] = cache.hits
+        summary["cache_misses"] = cache.misses
+    return summary
+
+
+def run_batch(args) -> bool:
+    """
+    Compiles every file of a batch, spread over a pool of args.jobs worker processes with one file per task, and writes the summary of every file (printed on stderr as each one finishes, and saved as JSON).
+
+    Returns:
+        True if every file compiled
+    """
+    start = time.perf_counter()
+    try:
+        inputs = batch_inputs(args.batch)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # the files are spread over the workers, so each one compiles its functions serially
+    file_args = argparse.Namespace(**vars(args))
+    file_args.jobs = 1
+    compile_one = functools.partial(compile_file, args=file_args)
+    tasks = [(fname, os.path.join(args.output_dir, output)) for fname, output in inputs]
+
+    summaries = []
+    pool = None
+    if args.jobs > 1 and len(tasks) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(args.jobs, len(tasks)), initializer=init_worker, initargs=(args.validate,))
+        results = [pool.submit(compile_one, fname, output) for fname, output in tasks]
+    else:
+        results = (compile_one(fname, output) for fname, output in tasks)
+
+    try:
+        for result in results:
+            summary = result.result() if isinstance(result, Future) else result
+            if summary["status"] == "ok":
+                print("%s: %.3fs, %d functions, %d spilled, %d instructions" % (summary["input"], summary["seconds"], summary["functions"],
+                                                                              summary["spilled"], summary["instructions"]), file=sys.stderr)
+            else:
+                print("%s: failed (%s)" % (summary["input"], summary["error"]), file=sys.stderr)
+            summaries.append(summary)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    failed = sum(1 for summary in summaries if summary["status"] != "ok")
+    elapsed = time.perf_counter() - start
+    print("batch: %d files, %d failed, %.3fs" % (len(summaries), failed, elapsed), file=sys.stderr)
+
+    summary_path = args.summary if args.summary is not None else os.path.join(args.output_dir, "summary.json")
+    with open(summary_path, "w") as fp:
+        json.dump(OrderedDict([("allocator", args.allocator), ("optimize", args.optimize), ("saved", args.saved), ("jobs", args.jobs),
+                               ("seconds", elapsed), ("files", summaries)]), fp, indent=2)
+
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, max_bytes=int(args.cache_max_size * 1024 * 1024), max_age=args.cache_max_age * 24 * 3600)
+        cache.evict()
+        hits = sum(summary.get("cache_hits", 0) for summary in summaries)
+        misses = sum(summary.get("cache_misses", 0) for summary in summaries)
+        print("cache: %d hits, %d misses, %d evicted" % (hits, misses, cache.evicted), file=sys.stderr)
+    return failed == 0
+
+
+def main(argv=None):
+    args = arg_parser.parse_args(argv)
+    CFG.validate = args.validate
+    if args.batch is not None:
+        if not run_batch(args):
+            sys.exit(1)
+        return
     fname = args.input
-    allocator = None
-    instructions = parse_instructions(fname)
-    functions = find_functions(instructions)
-    mc_functions = []
-
-    for func in functions:
-        translated = []
-        for i in func.body():
-            mc_instr = instr_to_asm(i, function=func)
-            translated += mc_instr
-
-        print_first = False
-        if print_first:
-            print(func.name + ":")
-            for i in translated:
-                print("\t%s" % i)
-
-        mc_functions.append(MCFunction(name=func.name, args=func.args, int_arrs=func.int_arrs, instrs=translated))
-
-
-    if args.allocator == "naive":
-        for func in mc_functions:
-            allocator = NaiveAllocator(func)
-            allocator.map_function()
-    elif args.allocator == "local":
-        for func in mc_functions:
-            allocator = LocalAllocator(func, use_saved=args.saved)
-            allocator.map_function()
-
-            # print(func.name)
-            # pp = pprint.PrettyPrinter(indent=4)
-            # pp.pprint(func.reg_maps)
-
-    # Continue selecting from here
-    should_print = False
-    outfile = args.output
-    outfile = open(outfile, "w")
-    if should_print:
-        print(".text")
+    if args.stream:
+        # read, compile and write one function at a time
+        functions = iter_functions(iter_instructions(fname))
+    else:
+        instructions = parse_instructions(fname)
+        functions = find_functions(instructions)
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = CompileCache(args.cache_dir, max_bytes=int(args.cache_max_size * 1024 * 1024), max_age=args.cache_max_age * 24 * 3600)
+
+    outfile = open(args.output, "w")
     outfile.write(".text\n")
-    for function in mc_functions:
-        prologue, translated_body, epilogue, rtn = parse_function(function, optimize=args.optimize)
-        # prologue, translated_body = parse_function(function)
-        outfile.write(function.name + ":\n")
-        if should_print:
-            print(function.name + ":")
-
-        for i in prologue:
-            outfile.write("\t%s\n" % i)
-            if should_print:
-                print("\t%s" % i)
-        outfile.write("\n")
-
-        for i in translated_body:
-            outfile.write("\t%s\n" % i)
-            if should_print:
-                print("\t%s" % i)
-        outfile.write("\n")
-
-        for i in epilogue:
-            outfile.write("\t%s\n" % i)
-            if should_print:
-                print("\t%s" % i)
-        outfile.write("\n")
-
-        for i in rtn:
-            outfile.write("\t%s\n" % i)
-            if should_print:
-                print("\t%s" % i)
+    totals = OrderedDict()
+    for text, stats in compile_functions(functions, args, cache=cache):
+        outfile.write(text)
+        if args.stream:
+            outfile.flush()
+        if args.report and len(stats) != 0:
+            name = text[:text.index(":")]
+            print("%s: %s" % (name, ", ".join("%s %d" % item for item in stats.items())), file=sys.stderr)
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
 
     outfile.close()
+    if len(totals) != 0:
+        print("total: %s" % ", ".join("%s %d" % item for item in totals.items()), file=sys.stderr)
+    if cache is not None:
+        cache.evict()
+        print(cache.stats_line(), file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -20,40 +20,69 @@ def needs_pad(function: MCFunction) -> bool:
         whether padding is needed
     """
     fp = 1
-    arr_length = sum(length for _, length in function.int_arrs)
+    args = 4
     ra = 1
-    # spill_count = len(function.spill_regs)
-    # saved_count = len(function.saved_regs)
-    # arg_count = arg_space(function)
-    num_vars = function.num_vars
-    # total = fp + arr_length + spill_count + ra + saved_count
+    arr_names = [name for name, _ in function.int_arrs]
+    num_locals = len([val for val in function.int_vals if val not in arr_names])
+    arr_words = sum(size for name, size in function.int_arrs if name in frame_arrays(function))
+    total = fp + len(arr_names) + arr_words + num_locals + len(function.temp_regs)
     if function.name != "main":
-        total = fp + ra + arr_length + num_vars + 10 + len(function.saved_regs)
-    else:
-        total = fp + arr_length + num_vars + 10 + len(function.saved_regs)
+        # main has no caller to save the s registers for
+        total += len(function.saved_regs)
+    if function.saves_args:
+        total += args
+    if function.calls_others and function.name != "main":
+        total += ra
 
     return total % 2 == 1
 
-def alloc_array(name: str, size: int, offset: int) -> List[MCInstruction]:
+# arrays are laid out in the frame as long as every $fp offset still fits in the 16 bit immediate of lw/sw, larger ones come from sbrk
+MAX_FRAME_ARRAY_WORDS = 4096
+
+def frame_arrays(function: MCFunction) -> List[str]:
+    """
+    Picks the local arrays that are laid out in the stack frame, in declaration order until their total size reaches MAX_FRAME_ARRAY_WORDS.
+    """
+    output = []
+    words = 0
+    for name, size in function.int_arrs:
+        if words + size <= MAX_FRAME_ARRAY_WORDS:
+            output.append(name)
+            words += size
+    return output
+
+def alloc_array(name: str, size: int, offset: int, saves_a0=False) -> List[MCInstruction]:
     syscode = 9
     output = []
     fp = "$fp"
 
     # syscall
+    if saves_a0:
+        output.append(MCInstruction("move", regs=["$v1", "$a0"]))
     output.append(MCInstruction("li", regs=["$v0"], imm=syscode))
     output.append(MCInstruction("li", regs=["$a0"], imm=size*4))
     output.append(MCInstruction("syscall"))
+    if saves_a0:
+        output.append(MCInstruction("move", regs=["$a0", "$v1"]))
 
     # store pointer on the stack
     output.append(MCInstruction("sw", regs=["$v0", fp], offset=offset))
 
     return output
 
+def frame_array(offset: int, base: int) -> List[MCInstruction]:
+    """
+    Stores the address of an array laid out in the frame (its first element at base($fp)) into its pointer slot.
+    """
+    fp = "$fp"
+    return [MCInstruction("addiu", regs=["$v0", fp], imm=base),
+            MCInstruction("sw", regs=["$v0", fp], offset=offset)]
+
 def calling_convention(function: MCFunction) -> (List[MCInstruction], List[MCInstruction], Dict[str, int]):
     """
     Handles the callee portion of the calling convention for a particular function. Note that this does not handle any of the caller responsibilities. Those should be handled by the code that deals with `call` and `callr` instructions.
 
-    Currently arrays are always spilled
+    Array pointers are always spilled, and the arrays are laid out in the frame when they are small enough
 
     Args:
         function: The function whose callee saving and restoring we are doing
@@ -80,21 +109,31 @@ def calling_convention(function: MCFunction) -> (List[MCInstruction], List[MCIns
     prologue.append(MCInstruction("move", regs=[fp, sp]))
 
     curr_offset = -4
-    # make space for arg registers
-    for i in range(4):
-        arg_reg = "$a%d" % i
-        # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
-        offsets[arg_reg] = curr_offset
-        curr_offset -= 4
+    # make space for arg registers, which are only saved around calls
+    if function.saves_args:
+        for i in range(4):
+            arg_reg = "$a%d" % i
+            # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
+            offsets[arg_reg] = curr_offset
+            curr_offset -= 4
 
-    # make space for arrays
+    # make space for array pointers
     arr_names = []
     for arr in function.int_arrs:
         arr_names.append(arr[0])
-        prologue += alloc_array(arr[0], arr[1], curr_offset)
         offsets[arr[0]] = curr_offset
         curr_offset -= 4
 
+    # make space for the arrays themselves, each one growing upwards from its first element
+    in_frame = frame_arrays(function)
+    for name, size in function.int_arrs:
+        if name in in_frame:
+            base = curr_offset - 4 * (size - 1)
+            prologue += frame_array(offsets[name], base)
+            curr_offset = base - 4
+        else:
+            prologue += alloc_array(name, size, offsets[name], saves_a0=len(function.args) != 0)
+
     # make space for local variables
     # for greedy local alloc, need to save everything (even non-spilled)
     for val in function.int_vals:
@@ -103,36 +142,33 @@ def calling_convention(function: MCFunction) -> (List[MCInstruction], List[MCIns
             offsets[val] = curr_offset
             curr_offset -= 4
 
-    # save all the t registers (as specified in the pdf)
-    for i in range(10):
-        t_reg = "$t%d" % i
-        # if function.name != "main":
-        # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
-        # prologue.append(MCInstruction("sw", regs=[t_reg, sp], imm=0))
-        prologue.append(MCInstruction("sw", regs=[t_reg, fp], offset=curr_offset))
+    # save the t registers this function writes (t registers are callee saved), main has no caller to save them for
+    # the spill code also uses these slots to save its temporaries around an instruction
+    for t_reg in function.temp_regs:
+        if function.name != "main":
+            prologue.append(MCInstruction("sw", regs=[t_reg, fp], offset=curr_offset))
         offsets[t_reg] = curr_offset
         curr_offset -= 4
-        # else:
-            # prologue.append(MCInstruction("li", regs=[t_reg], imm=0))
 
     # padding
     if needs_pad(function):
         # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
         curr_offset -= 4
 
-    if function.name != "main":
+    if function.name != "main" and function.calls_others:
         # return address
         # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
         prologue.append(MCInstruction("sw", regs=["$ra", fp], offset=curr_offset))
         offsets["$ra"] = curr_offset
         curr_offset -= 4
 
-    # s registers
-    for s in function.saved_regs:
-        # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
-        prologue.append(MCInstruction("sw", regs=[s, fp], offset=curr_offset))
-        offsets[s] = curr_offset
-        curr_offset -= 4
+    # s registers, which main has no caller to save for
+    if function.name != "main":
+        for s in function.saved_regs:
+            # prologue.append(MCInstruction("addiu", regs=[sp, sp], imm=-4))
+            prologue.append(MCInstruction("sw", regs=[s, fp], offset=curr_offset))
+            offsets[s] = curr_offset
+            curr_offset -= 4
 
     # now, finally move the sp
     prologue.append(MCInstruction("addiu", regs=[sp, fp], imm=curr_offset+4))
@@ -142,18 +178,19 @@ def calling_convention(function: MCFunction) -> (List[MCInstruction], List[MCIns
 
     # restore the s registers
     # for s in function.saved_regs[::-1]:
-    for s in function.saved_regs:
-        epilogue.append(MCInstruction("lw", regs=[s, fp], offset=offsets[s]))
-
     if function.name != "main":
+        for s in function.saved_regs:
+            epilogue.append(MCInstruction("lw", regs=[s, fp], offset=offsets[s]))
+
+    if function.name != "main" and function.calls_others:
         # restore the return address
         epilogue.append(MCInstruction("lw", regs=["$ra", fp], offset=offsets["$ra"]))
         # epilogue.append(MCInstruction("addiu", regs=[sp, sp], imm=4))
 
     # restore t registers
-    for i in range(10):
-        t_reg = "$t%d" % i
-        epilogue.append(MCInstruction("lw", regs=[t_reg, fp], offset=offsets[t_reg]))
+    if function.name != "main":
+        for t_reg in function.temp_regs:
+            epilogue.append(MCInstruction("lw", regs=[t_reg, fp], offset=offsets[t_reg]))
 
     # restore the fp
     epilogue.append(MCInstruction("move", regs=[sp, fp])) # moving sp back to fp
@@ -253,7 +290,7 @@ def spill(reg_map: Dict[str, str], instr: MCInstruction, offsets: Dict[str, int]
 
                     if optimize:
                         temp_needs_save = temp_reg in reg_map.values()
-                        virt_needs_load = virtual in instr.get_uses()
+                        virt_needs_load = instr.reads(virtual)
                     else:
                         temp_needs_save = True
                         virt_needs_load = True
@@ -335,7 +372,7 @@ def convert_instr(reg_map, instr: MCInstruction, offsets: Dict[str, int], epilog
         - a list of instruction that's equivalent
     """
 
-    if instr.op == "ret":
+    if instr.is_return():
         return epilogue + rtn
 
     fp = "$fp"
@@ -358,14 +395,25 @@ def convert_instr(reg_map, instr: MCInstruction, offsets: Dict[str, int], epilog
 
     output += prologue
     output += save
-    instr.regs = new_regs
+    instr.set_regs(new_regs)
     output.append(instr)
     output += restore
     output += epilogue
 
     return output
 
-def load_and_save_locals(reg_map: Dict[str, int], offsets: Dict[str, int]) -> Tuple[List[MCInstruction], List[MCInstruction]]:
+def load_and_save_locals(reg_map: Dict[str, int], offsets: Dict[str, int], live_in=None, live_out=None) -> Tuple[List[MCInstruction], List[MCInstruction]]:
+    """
+    Computes the code that loads the mapped virtual registers of a block from the stack at the block entry, and saves them back before the block exits.
+
+    Args:
+        - reg_map: the register map of the block
+        - offsets: offsets dictionary
+        - live_in: if given, only these registers are loaded
+        - live_out: if given, only these registers are saved
+    Returns:
+        - the load code and the save code
+    """
     load = []
     save = []
     fp = "$fp"
@@ -378,12 +426,75 @@ def load_and_save_locals(reg_map: Dict[str, int], offsets: Dict[str, int]) -> Tu
 
     for virt, phys in reg_map.items():
         if phys != "spill" and arg_pattern.match(phys) is None:
-            offset = offsets[virt]
-            load.append(MCInstruction("lw", regs=[phys, fp], offset=offset))
-            save.append(MCInstruction("sw", regs=[phys, fp], offset=offset))
+            if live_in is None or virt in live_in:
+                load.append(MCInstruction("lw", regs=[phys, fp], offset=offsets[virt]))
+            if live_out is None or virt in live_out:
+                save.append(MCInstruction("sw", regs=[phys, fp], offset=offsets[virt]))
 
     return load, save
 
+def block_boundary_regs(function: MCFunction, bbid: int):
+    """
+    Finds the virtual registers of a block that are loaded from the stack at its entry and saved back before it exits.
+
+    Returns:
+        - the registers to load and the registers to save, or None for either if every mapped register is
+    """
+    if function.liveness is None:
+        return None, None
+    resident = function.resident
+    live_in = function.liveness.live_in_regs(bbid) - resident.keys()
+    # the stack copy is already up to date unless the block redefines the register
+    live_out = (function.liveness.live_out_regs(bbid) & function.liveness.def_regs(bbid)) - resident.keys()
+    return live_in, live_out
+
+def entry_resident_regs(function: MCFunction):
+    entry = min(function.bbs.keys())
+    return function.liveness.live_in_regs(entry) & function.resident.keys()
+
+def uses_frame_slots(function: MCFunction) -> bool:
+    """
+    Checks whether translating the body of a function loads or saves any virtual register to its stack slot at a block boundary.
+    """
+    arg_pattern = re.compile(r"\$a[0123]")
+
+    def in_slot(reg_map, virts):
+        for virt, phys in reg_map.items():
+            if phys != "spill" and arg_pattern.match(phys) is None and (virts is None or virt in virts):
+                return True
+        return False
+
+    if len(function.resident) != 0 and in_slot(function.resident, entry_resident_regs(function)):
+        return True
+    for bbid, reg_map in function.reg_maps.items():
+        live_in, live_out = block_boundary_regs(function, bbid)
+        if in_slot(reg_map, live_in) or in_slot(reg_map, live_out):
+            return True
+    return False
+
+def leaf_frame(function: MCFunction) -> Tuple[List[MCInstruction], List[MCInstruction]]:
+    """
+    Computes the prologue and epilogue of a leaf function whose body never touches the stack. There is no frame pointer and no return address to save, so only the t and s registers it writes are pushed (none for main).
+
+    Returns:
+        - the prologue and the epilogue
+    """
+    sp = "$sp"
+    if function.name == "main":
+        return [], []
+    regs = function.temp_regs + function.saved_regs
+    if len(regs) == 0:
+        return [], []
+
+    size = 4 * (len(regs) + len(regs) % 2) # keep sp a multiple of 8
+    prologue = [MCInstruction("addiu", regs=[sp, sp], imm=-size)]
+    epilogue = []
+    for i, reg in enumerate(regs):
+        prologue.append(MCInstruction("sw", regs=[reg, sp], offset=4*i))
+        epilogue.append(MCInstruction("lw", regs=[reg, sp], offset=4*i))
+    epilogue.append(MCInstruction("addiu", regs=[sp, sp], imm=size))
+    return prologue, epilogue
+
 def translate_body(function: MCFunction, offsets: Dict[str, int], epilogue, rtn, optimize=False) -> Tuple[bool, List[MCInstruction]]:
     """
     Translates the body of a function one by one. Should call methods like convert_instr.
@@ -399,12 +510,20 @@ def translate_body(function: MCFunction, offsets: Dict[str, int], epilogue, rtn,
     sorted_keys = list(function.bbs.keys())
     sorted_keys.sort()
     has_returned = False
+
+    resident = function.resident
+    if len(resident) != 0:
+        # resident registers keep their values across blocks, so they are only loaded once, ahead of any label
+        load, _ = load_and_save_locals(resident, offsets, live_in=entry_resident_regs(function), live_out=set())
+        output += load
+
     for k in sorted_keys:
         bb = function.bbs[k]
         reg_map = function.reg_maps[k]
 
-        load, save = load_and_save_locals(reg_map, offsets)
-        if bb[0].op == "label":
+        live_in, live_out = block_boundary_regs(function, k)
+        load, save = load_and_save_locals(reg_map, offsets, live_in=live_in, live_out=live_out)
+        if bb[0].is_label():
             label = bb.pop(0)
             output.append(label)
         # if len(bb) > 0 and (bb[-1].is_branch() or bb[-1].is_jump()):
@@ -415,7 +534,7 @@ def translate_body(function: MCFunction, offsets: Dict[str, int], epilogue, rtn,
 
         output += load
         for instr in bb:
-            if instr.op == "ret":
+            if instr.is_return():
                 has_returned = True
             
             if instr.is_jump() or instr.is_branch():
@@ -455,8 +574,12 @@ def parse_function(function: MCFunction, optimize=False) -> Tuple[List[MCInstruc
             else:
                 reg_map[arg] = "spill"
 
-    # prologue = get_prologue(function)
-    prologue, epilogue, offsets = calling_convention(function)
+    if function.stack_type == "simple_leaf" and not uses_frame_slots(function):
+        # nothing in the body refers to $fp, so the function does not need a frame
+        prologue, epilogue = leaf_frame(function)
+        offsets = {}
+    else:
+        prologue, epilogue, offsets = calling_convention(function)
 
     # if function.name == "main":
         # print(function.name)
@@ -0,0 +1,434 @@
+import argparse
+import bisect
+import glob
+import json
+import operator
+import os
+import sys
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple
+
+arg_parser = argparse.ArgumentParser(description='run generated assembly on the test inputs and count the instructions executed')
+arg_parser.add_argument('--asm', type=str, help='assembly file produced by runner')
+arg_parser.add_argument('--tests', type=str, nargs='+', help='directories of N.in/N.out files, or single .in files')
+arg_parser.add_argument('--limit', type=int, default=100000000, help='maximum number of instructions executed per run')
+arg_parser.add_argument('--functions', action='store_true', default=False, help='print the counts of every function')
+arg_parser.add_argument('--json', type=str, help='also write the results to this JSON file')
+
+REGISTER_NAMES = ["$zero", "$at", "$v0", "$v1", "$a0", "$a1", "$a2", "$a3",
+                  "$t0", "$t1", "$t2", "$t3", "$t4", "$t5", "$t6", "$t7",
+                  "$s0", "$s1", "$s2", "$s3", "$s4", "$s5", "$s6", "$s7",
+                  "$t8", "$t9", "$k0", "$k1", "$gp", "$sp", "$fp", "$ra"]
+REGISTERS = {name: i for i, name in enumerate(REGISTER_NAMES)}
+REGISTERS.update({"$%d" % i: i for i in range(32)})
+REGISTERS["$s8"] = REGISTERS["$fp"]
+ZERO, V0, A0, GP, SP, RA = 0, 2, 4, 28, 29, 31
+
+STACK_START = 0x7fffeffc
+HEAP_START = 0x10040000
+GP_START = 0x10008000
+
+
+class SimulationError(Exception):
+    pass
+
+
+def wrap(value: int) -> int:
+    # registers hold 32 bit two's complement values
+    return ((value + 0x80000000) & 0xffffffff) - 0x80000000
+
+def div(a: int, b: int) -> int:
+    # SPIM's div pseudo instruction rounds towards zero
+    if b == 0:
+        raise SimulationError("division by zero")
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+ARITHMETIC = {
+    "add": operator.add, "addu": operator.add, "addi": operator.add, "addiu": operator.add,
+    "sub": operator.sub, "subu": operator.sub,
+    "mul": operator.mul, "div": div,
+    "and": operator.and_, "andi": operator.and_, "or": operator.or_, "ori": operator.or_,
+    "sll": operator.lshift, "sra": operator.rshift, "srl": lambda a, b: (a & 0xffffffff) >> b,
+}
+BRANCHES = {"beq": operator.eq, "bne": operator.ne, "blt": operator.lt,
+            "bgt": operator.gt, "ble": operator.le, "bge": operator.ge}
+ZERO_BRANCHES = {"blez": operator.le, "bgez": operator.ge, "bltz": operator.lt,
+                 "bgtz": operator.gt, "beqz": operator.eq, "bnez": operator.ne}
+
+# decoded instruction kinds, in roughly the order of how often they are executed
+LW, SW, ARITH_I, ARITH_R, MOVE, LI, BRANCH_R, BRANCH_I, J, JAL, JR, SYSCALL, MULT, MFHI, MFLO, NOP = range(16)
+
+
+class Program(NamedTuple):
+    instrs: List[tuple]     # decoded (kind, a, b, c, d) of every instruction
+    costs: List[int]        # the number of machine instructions SPIM assembles every instruction into
+    text: List[str]         # source text of every instruction
+    labels: Dict[str, int]
+    functions: List[str]    # the function every instruction belongs to
+
+
+def parse_register(token: str, line: str) -> int:
+    if token not in REGISTERS:
+        raise ValueError("Unexpected register %s in: %s" % (token, line))
+    return REGISTERS[token]
+
+def parse_address(token: str, line: str):
+    """
+    Parses `offset($base)` or `($base)`.
+
+    Returns:
+        - the base register and the offset
+    """
+    opening = token.find("(")
+    if opening == -1 or not token.endswith(")"):
+        raise ValueError("Unexpected address %s in: %s" % (token, line))
+    offset = int(token[:opening], 0) if opening != 0 else 0
+    return parse_register(token[opening+1:-1], line), offset
+
+def decode(op: str, operands: List[str], line: str) -> tuple:
+    if op == "lw" or op == "sw":
+        base, offset = parse_address(operands[1], line)
+        return (LW if op == "lw" else SW, parse_register(operands[0], line), base, offset, None)
+    if op in ARITHMETIC:
+        if len(operands) == 2:
+            # two operand form, e.g. addi $t0, 4 is addi $t0, $t0, 4
+            operands = [operands[0]] + operands
+        dest = parse_register(operands[0], line)
+        src = parse_register(operands[1], line)
+        if operands[2].startswith("$"):
+            return (ARITH_R, ARITHMETIC[op], dest, src, parse_register(operands[2], line))
+        return (ARITH_I, ARITHMETIC[op], dest, src, int(operands[2], 0))
+    if op == "move":
+        return (MOVE, parse_register(operands[0], line), parse_register(operands[1], line), None, None)
+    if op == "li":
+        return (LI, parse_register(operands[0], line), wrap(int(operands[1], 0)), None, None)
+    if op in BRANCHES:
+        src = parse_register(operands[0], line)
+        if operands[1].startswith("$"):
+            return (BRANCH_R, BRANCHES[op], src, parse_register(operands[1], line), operands[2])
+        return (BRANCH_I, BRANCHES[op], src, int(operands[1], 0), operands[2])
+    if op in ZERO_BRANCHES:
+        return (BRANCH_I, ZERO_BRANCHES[op], parse_register(operands[0], line), 0, operands[1])
+    if op == "j":
+        return (J, operands[0], None, None, None)
+    if op == "jal":
+        return (JAL, operands[0], None, None, None)
+    if op == "jr":
+        return (JR, parse_register(operands[0], line), None, None, None)
+    if op == "mult":
+        return (MULT, parse_register(operands[0], line), parse_register(operands[1], line), None, None)
+    if op == "mfhi" or op == "mflo":
+        return (MFHI if op == "mfhi" else MFLO, parse_register(operands[0], line), None, None, None)
+    if op == "syscall":
+        return (SYSCALL, None, None, None, None)
+    if op == "nop" or op == "noop":
+        return (NOP, None, None, None, None)
+    raise ValueError("Unexpected instruction: %s" % line)
+
+
+def fits_signed(imm: int) -> bool:
+    return -0x8000 <= imm <= 0x7fff
+
+def fits_unsigned(imm: int) -> bool:
+    return 0 <= imm <= 0xffff
+
+def load_cost(imm: int) -> int:
+    # li is one addiu or ori if the value fits in 16 bits, otherwise a lui followed by an ori unless the low half is zero
+    imm = wrap(imm)
+    if fits_signed(imm) or fits_unsigned(imm):
+        return 1
+    return 1 if imm & 0xffff == 0 else 2
+
+def spim_cost(op: str, instr: tuple) -> int:
+    """
+    Counts the machine instructions SPIM expands an instruction into when it is executed. Immediates that do not fit in the 16 bit field are first loaded into $at, the compare-and-branch pseudo instructions are an slt and a beq or bne, and mul and div also read lo with mflo (div first checks for a zero divisor, and the break after that check is skipped).
+    """
+    kind = instr[0]
+    if kind == LW or kind == SW:
+        # a large offset is added to the base in $at first
+        return 1 if fits_signed(instr[3]) else 3
+    if kind == LI:
+        return load_cost(instr[2])
+    if kind == ARITH_R:
+        if op == "mul":
+            return 2
+        if op == "div":
+            return 3
+        return 1
+    if kind == ARITH_I:
+        imm = instr[4]
+        if op == "mul" or op == "div":
+            return load_cost(imm) + 2
+        if op in ("sll", "sra", "srl"):
+            return 1
+        if op in ("and", "andi", "or", "ori"):
+            # the logical immediates are zero extended
+            fits = fits_unsigned(imm)
+        elif op == "sub" or op == "subu":
+            fits = fits_signed(-imm)
+        else:
+            fits = fits_signed(imm)
+        return 1 if fits else load_cost(imm) + 1
+    if kind == BRANCH_R:
+        return 1 if op == "beq" or op == "bne" else 2
+    if kind == BRANCH_I:
+        imm = instr[3]
+        if op in ZERO_BRANCHES:
+            return 1
+        if op == "beq" or op == "bne":
+            return 1 if imm == 0 else load_cost(imm) + 1
+        if (op == "blt" or op == "bge") and fits_signed(imm):
+            # slti, then bne or beq
+            return 2
+        return load_cost(imm) + 2
+    return 1
+
+
+def load_program(fname: str) -> Program:
+    """
+    Assembles a file once into a list of decoded instructions with every label resolved, so running it never has to look at the text again. Every instruction belongs to the function whose label (main, or any jal target) most recently precedes it.
+    """
+    instrs = []
+    costs = []
+    text = []
+    labels = {}
+    with open(fname, "r") as fp:
+        for line in fp:
+            line = line.split("#", 1)[0].strip()
+            if line == "" or line.startswith("."):
+                continue
+            if line.endswith(":"):
+                labels[line[:-1]] = len(instrs)
+                continue
+            parts = line.split(None, 1)
+            operands = [o.strip() for o in parts[1].split(",")] if len(parts) > 1 else []
+            instrs.append(decode(parts[0], operands, line))
+            costs.append(spim_cost(parts[0], instrs[-1]))
+            text.append(line)
+
+    # resolve the targets of branches and jumps
+    called = {"main"}
+    for i, instr in enumerate(instrs):
+        kind = instr[0]
+        target = instr[1] if kind == J or kind == JAL else instr[4] if kind == BRANCH_R or kind == BRANCH_I else None
+        if target is None:
+            continue
+        if target not in labels:
+            raise ValueError("Unknown label %s in: %s" % (target, text[i]))
+        if kind == JAL:
+            called.add(target)
+            instrs[i] = (kind, labels[target], None, None, None)
+        elif kind == J:
+            instrs[i] = (kind, labels[target], None, None, None)
+        else:
+            instrs[i] = instr[:4] + (labels[target],)
+
+    if "main" not in labels:
+        raise ValueError("%s has no main" % fname)
+
+    starts = sorted((labels[name], name) for name in called)
+    positions = [pos for pos, _ in starts]
+    functions = []
+    for pc in range(len(instrs)):
+        idx = bisect.bisect_right(positions, pc) - 1
+        functions.append(starts[idx][1] if idx >= 0 else "?")
+
+    return Program(instrs, costs, text, labels, functions)
+
+
+class FunctionStats(NamedTuple):
+    instructions: int
+    loads: int
+    stores: int
+
+
+class RunResult(NamedTuple):
+    output: str
+    instructions: int
+    loads: int
+    stores: int
+    functions: Dict[str, FunctionStats]
+
+
+def run(program: Program, input_text: str, limit: int=100000000) -> RunResult:
+    """
+    Runs a program from main until it exits (syscall 10), reading integers from input_text for syscall 5.
+
+    Args:
+        - program: the program from load_program
+        - input_text: the whitespace separated integers read by the program
+        - limit: the maximum number of instructions to execute
+
+    Returns:
+        - what the program printed and how many instructions (counted as SPIM expands them), loads and stores it executed, in total and per function
+    """
+    instrs = program.instrs
+    costs = program.costs
+    counts = [0] * len(instrs)
+    r = [0] * 32
+    hi = lo = 0
+    r[SP] = STACK_START
+    r[GP] = GP_START
+    mem = {}
+    heap = HEAP_START
+    tokens = input_text.split()
+    next_token = 0
+    output = []
+
+    pc = program.labels["main"]
+    executed = 0
+    while True:
+        if pc >= len(instrs):
+            raise SimulationError("ran past the end of the program")
+        counts[pc] += 1
+        executed += costs[pc]
+        if executed > limit:
+            raise SimulationError("executed more than %d instructions" % limit)
+        kind, a, b, c, d = instrs[pc]
+        pc += 1
+        if kind == LW:
+            addr = r[b] + c
+            if addr & 3:
+                raise SimulationError("unaligned load from %#x" % addr)
+            if a:
+                r[a] = mem.get(addr, 0)
+        elif kind == SW:
+            addr = r[b] + c
+            if addr & 3:
+                raise SimulationError("unaligned store to %#x" % addr)
+            mem[addr] = r[a]
+        elif kind == ARITH_I:
+            if b:
+                r[b] = wrap(a(r[c], d))
+        elif kind == ARITH_R:
+            if b:
+                r[b] = wrap(a(r[c], r[d]))
+        elif kind == MOVE:
+            if a:
+                r[a] = r[b]
+        elif kind == LI:
+            if a:
+                r[a] = b
+        elif kind == BRANCH_R:
+            if a(r[b], r[c]):
+                pc = d
+        elif kind == BRANCH_I:
+            if a(r[b], c):
+                pc = d
+        elif kind == J:
+            pc = a
+        elif kind == JAL:
+            r[RA] = pc
+            pc = a
+        elif kind == JR:
+            pc = r[a]
+        elif kind == MULT:
+            product = r[a] * r[b]
+            hi, lo = wrap(product >> 32), wrap(product)
+        elif kind == MFHI:
+            if a:
+                r[a] = hi
+        elif kind == MFLO:
+            if a:
+                r[a] = lo
+        elif kind == SYSCALL:
+            code = r[V0]
+            if code == 1:
+                output.append(str(r[A0]))
+            elif code == 5:
+                if next_token >= len(tokens):
+                    raise SimulationError("read past the end of the input")
+                r[V0] = wrap(int(tokens[next_token]))
+                next_token += 1
+            elif code == 9:
+                r[V0] = heap
+                heap += (r[A0] + 3) // 4 * 4
+            elif code == 10:
+                break
+            elif code == 11:
+                output.append(chr(r[A0] & 0xff))
+            else:
+                raise SimulationError("unsupported syscall %d" % code)
+
+    per_function = OrderedDict()
+    totals = {}
+    for pc, count in enumerate(counts):
+        if count == 0:
+            continue
+        kind = instrs[pc][0]
+        stats = totals.setdefault(program.functions[pc], [0, 0, 0])
+        stats[0] += count * program.costs[pc]
+        if kind == LW:
+            stats[1] += count
+        elif kind == SW:
+            stats[2] += count
+    for name in sorted(totals, key=lambda name: -totals[name][0]):
+        per_function[name] = FunctionStats(*totals[name])
+
+    loads = sum(stats.loads for stats in per_function.values())
+    stores = sum(stats.stores for stats in per_function.values())
+    return RunResult("".join(output), executed, loads, stores, per_function)
+
+
+def find_cases(paths: List[str]) -> List[str]:
+    cases = []
+    for path in paths:
+        if os.path.isdir(path):
+            cases += sorted(glob.glob(os.path.join(path, "*.in")))
+        else:
+            cases.append(path)
+    return cases
+
+
+def main():
+    args = arg_parser.parse_args()
+    program = load_program(args.asm)
+
+    results = []
+    failed = 0
+    total = FunctionStats(0, 0, 0)
+    for case in find_cases(args.tests):
+        with open(case, "r") as fp:
+            input_text = fp.read()
+        expected_file = case[:-3] + ".out"
+        expected = None
+        if os.path.exists(expected_file):
+            with open(expected_file, "r") as fp:
+                expected = fp.read()
+
+        try:
+            result = run(program, input_text, limit=args.limit)
+        except SimulationError as e:
+            print("%-24s ERROR %s" % (case, e))
+            results.append(OrderedDict([("case", case), ("status", "error"), ("error", str(e))]))
+            failed += 1
+            continue
+
+        if expected is None:
+            status = "ran"
+        elif result.output.strip() == expected.strip():
+            status = "ok"
+        else:
+            status = "fail"
+            failed += 1
+        total = FunctionStats(total.instructions + result.instructions, total.loads + result.loads, total.stores + result.stores)
+        print("%-24s %-5s instructions %9d  loads %8d  stores %8d" % (case, status.upper(), result.instructions, result.loads, result.stores))
+        if args.functions:
+            for name, stats in result.functions.items():
+                print("    %-20s instructions %9d  loads %8d  stores %8d" % (name, stats.instructions, stats.loads, stats.stores))
+
+        results.append(OrderedDict([("case", case), ("status", status), ("instructions", result.instructions),
+                                    ("loads", result.loads), ("stores", result.stores),
+                                    ("functions", OrderedDict((name, stats._asdict()) for name, stats in result.functions.items()))]))
+
+    print("%-24s %-5s instructions %9d  loads %8d  stores %8d" % ("total", "", total.instructions, total.loads, total.stores))
+    if args.json is not None:
+        with open(args.json, "w") as fp:
+            json.dump(OrderedDict([("asm", args.asm), ("total", total._asdict()), ("cases", results)]), fp, indent=2)
+
+    if failed != 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()